@@ -0,0 +1,289 @@
+"""
+構造化抽出結果（Geminiの解析JSON）のキャッシュ
+
+同じPDF/画像・プロンプト・モデルの組み合わせは同じ結果になる前提で、
+内容ハッシュをキーに解析結果を保存する。
+プロセス内のメモリLRU（GEMINI_CACHE_MEMORY_ENTRIES件）を常に使い、
+環境変数 GEMINI_CACHE_DIR を設定した場合はJSONファイルとしてディスクにも保存する。
+有効期限 GEMINI_CACHE_TTL_SECONDS はメモリ層・ディスク層の両方に適用する。
+"""
+
+import os
+import json
+import asyncio
+import hashlib
+import logging
+import pathlib
+import tempfile
+import functools
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import Any, Dict, Optional, Tuple, Union
+
+logger = logging.getLogger("pdf_highlight_api.cache")
+
+# メモリ層の既定値（件数0でメモリ層無効、TTL 0で期限なし）
+_DEFAULT_MEMORY_ENTRIES = 128
+_DEFAULT_TTL_SECONDS = 3600
+
+# orjsonが利用可能ならエントリの読み書きに使用（未導入時は標準jsonにフォールバック）
+try:
+    import orjson
+
+    _json_loads = orjson.loads
+
+    def _json_dumps_bytes(obj: Any) -> bytes:
+        return orjson.dumps(obj)
+
+except ImportError:  # pragma: no cover - depends on installed extras
+    _json_loads = json.loads
+
+    def _json_dumps_bytes(obj: Any) -> bytes:
+        return json.dumps(obj, ensure_ascii=False).encode("utf-8")
+
+
+def extraction_cache_key(*parts: Union[bytes, str]) -> str:
+    """sha256 over length-prefixed parts, so ("ab", "c") and ("a", "bc") differ."""
+    h = hashlib.sha256()
+    for part in parts:
+        data = part.encode("utf-8") if isinstance(part, str) else part
+        h.update(len(data).to_bytes(8, "big"))
+        h.update(data)
+    return h.hexdigest()
+
+
+class ExtractionCache:
+    """
+    内容アドレス方式の解析結果キャッシュ
+
+    メモリLRUを先に引き、外れた場合のみディスク（<cache_dir>/<key>.json）を読む。
+    cache_dir がNoneならメモリ層のみで動作する。
+    非同期の呼び出し元は aget / aput / adelete を使い、ディスクI/Oをイベントループの外で行う。
+    """
+
+    def __init__(
+        self,
+        cache_dir: Optional[Union[str, pathlib.Path]] = None,
+        memory_entries: int = _DEFAULT_MEMORY_ENTRIES,
+        ttl_seconds: float = _DEFAULT_TTL_SECONDS,
+    ):
+        self.cache_dir = pathlib.Path(cache_dir) if cache_dir else None
+        if self.cache_dir is not None:
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.memory_entries = memory_entries
+        self.ttl_seconds = ttl_seconds
+        # key -> (保存時刻, シリアライズ済みdata)。取り出しのたびにデコードするため
+        # 呼び出し側が返り値を書き換えても（_debug付与など）キャッシュは汚れない
+        self._memory: "OrderedDict[str, tuple]" = OrderedDict()
+        # プロセス内のヒット/ミス件数（/cache/stats 用）
+        self.hits = 0
+        self.misses = 0
+
+    def _path(self, key: str) -> pathlib.Path:
+        return self.cache_dir / f"{key}.json"
+
+    def _memory_get(self, key: str) -> Optional[Dict[str, Any]]:
+        """Return a fresh copy from the memory tier, dropping expired entries."""
+        item = self._memory.get(key)
+        if item is None:
+            return None
+        stored_at, blob = item
+        if self.ttl_seconds and time.monotonic() - stored_at > self.ttl_seconds:
+            del self._memory[key]
+            return None
+        self._memory.move_to_end(key)
+        return _json_loads(blob)
+
+    def _memory_put(self, key: str, data: Dict[str, Any], age: float = 0.0) -> None:
+        """Store data in the memory tier, evicting least recently used entries.
+
+        age backdates the entry so a result promoted from disk keeps its
+        original expiry instead of getting a fresh TTL.
+        """
+        if self.memory_entries <= 0:
+            return
+        try:
+            blob = _json_dumps_bytes(data)
+        except Exception:
+            logger.warning("Failed to serialize cache entry %s", key, exc_info=True)
+            return
+        self._memory[key] = (time.monotonic() - age, blob)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+
+    def _entry_age(self, entry: Dict[str, Any]) -> Optional[float]:
+        """Seconds since a disk entry was written; None when created_at is missing or invalid."""
+        try:
+            created_at = datetime.fromisoformat(entry["created_at"])
+        except (KeyError, TypeError, ValueError):
+            return None
+        return max(0.0, (datetime.now(timezone.utc) - created_at).total_seconds())
+
+    def _disk_read(self, key: str) -> Optional[Tuple[Dict[str, Any], float]]:
+        """Read (data, age) from the disk tier, deleting unreadable or expired entries.
+
+        Touches only the file system, so it is safe to run in a worker thread.
+        """
+        path = self._path(key)
+        try:
+            with path.open("rb") as f:
+                entry = _json_loads(f.read())
+        except FileNotFoundError:
+            return None
+        except Exception:
+            logger.warning("Discarding unreadable cache entry %s", path, exc_info=True)
+            self._disk_delete(key)
+            return None
+        data = entry.get("data") if isinstance(entry, dict) else None
+        if not isinstance(data, dict):
+            return None
+        # ディスク層にもTTLを適用し、期限切れ（保存時刻が不明なものを含む）は削除する
+        age = self._entry_age(entry)
+        if self.ttl_seconds and (age is None or age > self.ttl_seconds):
+            self._disk_delete(key)
+            return None
+        return data, age or 0.0
+
+    def _disk_write(
+        self, key: str, data: Dict[str, Any], metadata: Optional[Dict[str, Any]]
+    ) -> None:
+        """Atomically write an entry to the disk tier (safe to run in a worker thread)."""
+        entry = {
+            "created_at": datetime.now(timezone.utc).isoformat(),
+            "metadata": metadata or {},
+            "data": data,
+        }
+        tmp_path = None
+        try:
+            fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+            with os.fdopen(fd, "wb") as f:
+                f.write(_json_dumps_bytes(entry))
+            os.replace(tmp_path, self._path(key))
+        except Exception:
+            logger.warning("Failed to write cache entry %s", key, exc_info=True)
+            if tmp_path:
+                try:
+                    os.unlink(tmp_path)
+                except OSError:
+                    pass
+
+    def _disk_delete(self, key: str) -> None:
+        """Remove an entry file from the disk tier, if present."""
+        try:
+            self._path(key).unlink()
+        except FileNotFoundError:
+            pass
+
+    def _finish_get(
+        self, key: str, found: Optional[Tuple[Dict[str, Any], float]]
+    ) -> Optional[Dict[str, Any]]:
+        """Count a disk lookup and promote a hit into the memory tier."""
+        if found is None:
+            self.misses += 1
+            return None
+        data, age = found
+        self._memory_put(key, data, age=age)
+        self.hits += 1
+        return data
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """
+        キャッシュ済みの解析結果を返す（未登録・期限切れ・破損時はNone）
+        """
+        data = self._memory_get(key)
+        if data is not None:
+            self.hits += 1
+            return data
+        if self.cache_dir is None:
+            self.misses += 1
+            return None
+        return self._finish_get(key, self._disk_read(key))
+
+    async def aget(self, key: str) -> Optional[Dict[str, Any]]:
+        """
+        get の非同期版（メモリ層はその場で引き、ディスクの読み込みはワーカースレッドで行う）
+        """
+        data = self._memory_get(key)
+        if data is not None:
+            self.hits += 1
+            return data
+        if self.cache_dir is None:
+            self.misses += 1
+            return None
+        return self._finish_get(key, await asyncio.to_thread(self._disk_read, key))
+
+    def put(
+        self, key: str, data: Dict[str, Any], metadata: Optional[Dict[str, Any]] = None
+    ) -> None:
+        """
+        解析結果を保存する（一時ファイルに書いてから置き換えるため途中状態は読まれない）
+        """
+        self._memory_put(key, data)
+        if self.cache_dir is not None:
+            self._disk_write(key, data, metadata)
+
+    async def aput(
+        self, key: str, data: Dict[str, Any], metadata: Optional[Dict[str, Any]] = None
+    ) -> None:
+        """
+        put の非同期版（ディスクへの書き込みはワーカースレッドで行う）
+        """
+        self._memory_put(key, data)
+        if self.cache_dir is not None:
+            await asyncio.to_thread(self._disk_write, key, data, metadata)
+
+    def delete(self, key: str) -> None:
+        """
+        キャッシュエントリを削除する
+        """
+        self._memory.pop(key, None)
+        if self.cache_dir is not None:
+            self._disk_delete(key)
+
+    async def adelete(self, key: str) -> None:
+        """
+        delete の非同期版（ファイルの削除はワーカースレッドで行う）
+        """
+        self._memory.pop(key, None)
+        if self.cache_dir is not None:
+            await asyncio.to_thread(self._disk_delete, key)
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        エントリ数・合計サイズとプロセス内のヒット率を返す（ディスク層無効時はディスク項目がNone）
+        """
+        entries = None
+        total_bytes = None
+        if self.cache_dir is not None:
+            entries = 0
+            total_bytes = 0
+            with os.scandir(self.cache_dir) as it:
+                for e in it:
+                    if e.name.endswith(".json") and e.is_file():
+                        entries += 1
+                        total_bytes += e.stat().st_size
+        lookups = self.hits + self.misses
+        return {
+            "cache_dir": str(self.cache_dir) if self.cache_dir is not None else None,
+            "entries": entries,
+            "total_bytes": total_bytes,
+            "memory_entries": len(self._memory),
+            "memory_max_entries": self.memory_entries,
+            "ttl_seconds": self.ttl_seconds,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": (self.hits / lookups) if lookups else None,
+        }
+
+
+@functools.lru_cache(maxsize=None)
+def get_extraction_cache() -> Optional[ExtractionCache]:
+    """プロセス共有のキャッシュを返す（メモリ層・ディスク層がともに無効ならNone）"""
+    cache_dir = os.getenv("GEMINI_CACHE_DIR") or None
+    memory_entries = int(os.getenv("GEMINI_CACHE_MEMORY_ENTRIES", str(_DEFAULT_MEMORY_ENTRIES)))
+    ttl_seconds = float(os.getenv("GEMINI_CACHE_TTL_SECONDS", str(_DEFAULT_TTL_SECONDS)))
+    if not cache_dir and memory_entries <= 0:
+        return None
+    return ExtractionCache(cache_dir, memory_entries=memory_entries, ttl_seconds=ttl_seconds)
@@ -1,10 +1,868 @@
+import io
 import os
+import re
+import copy
 import json
+import math
+import time
+import random
+import asyncio
+import hashlib
 import logging
-from typing import List, Dict, Any, Optional
+import functools
+import pathlib
+from collections import OrderedDict
+from typing import Annotated, Callable, List, Dict, Any, Optional, Tuple
+import httpx
 import google.genai as genai
-from google.genai import types
+from google.genai import errors, types
 from PIL import Image, ImageDraw
+from pydantic import BaseModel, BeforeValidator, ConfigDict, Field, ValidationError
+
+from src.infrastructure.cache import extraction_cache_key, get_extraction_cache
+from src.infrastructure.pdf import PdfPageRenderer
+
+# orjsonが利用可能ならJSONパースに使用（未導入時は標準jsonにフォールバック）
+try:
+    import orjson
+
+    _json_loads = orjson.loads
+except ImportError:  # pragma: no cover - depends on installed extras
+    _json_loads = json.loads
+
+# 429 (RESOURCE_EXHAUSTED) / 5xx 発生時のリトライ設定
+_RETRY_MAX_ATTEMPTS = 3
+_RETRY_BASE_BACKOFF_S = 1.0
+
+# Gemini APIへのHTTP接続設定（プロセス内のクライアントで共有するコネクションプール）
+# PDF全体の解析は数分かかることがあるためタイムアウトは長めに取る
+_HTTP_TIMEOUT_MS = 300_000
+_HTTP_MAX_CONNECTIONS = 100
+_HTTP_MAX_KEEPALIVE_CONNECTIONS = 20
+
+# 構造化出力（response_schema）に確実に対応しているモデル系列
+# これらではスキーマなしのフォールバック再送を行わない
+_STRUCTURED_OUTPUT_MODEL_PREFIXES = ("gemini-2.5-", "gemini-2.0-")
+# 上記以外のモデルで判明した構造化出力への対応可否（モデル名 -> bool、プロセス内で共有）
+# 一度拒否されたモデルはスキーマ付きリクエストを省略し、成功したモデルは再送しない
+_structured_output_support: Dict[str, bool] = {}
+
+# Geminiの明示的コンテキストキャッシュ設定
+# 同じPDFが2回目に解析されたときにキャッシュを作成し、以降はPDF本体と固定指示文を再送しない
+# （最小トークン数に満たない小さなPDFはキャッシュ作成自体が失敗するため対象外）
+_CONTEXT_CACHE_MIN_PDF_BYTES = 512 * 1024
+_CONTEXT_CACHE_TTL_S = 3600
+# 期限切れ直前のキャッシュ名を使わないための余裕
+_CONTEXT_CACHE_EXPIRY_MARGIN_S = 60
+
+
+# 構造化出力未対応時のフォールバック指示（JSONの雛形はリクエスト毎にシリアライズしない）
+_FALLBACK_JSON_INSTRUCTION = "必ず次の形式のJSONのみを返してください: "
+_PDF_FALLBACK_EXAMPLE = (
+    '{"summary": {"total_detections": 0, "pf100_count": 0, "pf150_fd_count": 0}, '
+    '"pages": []}'
+)
+_PAGES_FALLBACK_EXAMPLE = '{"summary": {"total_detections": 0}, "pages": []}'
+_DETECTIONS_FALLBACK_EXAMPLE = (
+    '{"detections": [{"symbol_bbox": [0, 0, 0, 0], "confidence": 0.0}], '
+    '"summary": {"total_detections": 0}}'
+)
+_SYMBOL_BATCH_FALLBACK_EXAMPLE = (
+    '{"pages": [{"page": 1, "detections": [{"symbol_bbox": [0, 0, 0, 0], "confidence": 0.0}]}]}'
+)
+
+# フォールバック分析で使う正規表現・変換テーブル（呼び出し毎のコンパイルを避ける）
+_PF_NUMBER_RE = re.compile(r"PF(\d+)", re.IGNORECASE)
+_PHI_TRANS = str.maketrans({"φ": "phi", "Φ": "phi"})
+
+
+def _strip_code_fence(text: str) -> str:
+    """Strip a ```json / ``` fence that models emit around JSON text."""
+    text = text.strip()
+    if text.startswith("```json"):
+        text = text.removeprefix("```json")
+    elif text.startswith("```"):
+        text = text.removeprefix("```")
+    else:
+        return text
+    return text.removesuffix("```").strip()
+
+
+# ---- 静的プロンプト ----------------------------------------------------------
+# 呼び出しごとに同一の指示文はモジュール定数として保持し、リクエストの先頭に置く
+# （Geminiのプレフィックスキャッシュが効くよう、可変部分は末尾にのみ付加する）
+_SYMBOL_DETECTION_PROMPT = (
+    "あなたは図面上の記号検出器です。"
+    "赤枠があれば枠内のみを解析し、参照画像（target.png）と同一形状の記号のみ検出。"
+    "回転・スケール差やノイズに頑健に一致させ、誤検出は避ける。"
+    "座標は必ず[0,1000]の範囲に正規化して返すこと。"
+    "画像の左上を(0,0)、右下を(1000,1000)とする正規化座標系を使用。"
+    "各検出は 'symbol_bbox': [x, y, width, height] を[0,1000]の範囲で返してください。"
+    "補助として 'box_2d': [ymin, xmin, ymax, xmax] も[0,1000]の範囲で含めてもよい。"
+    "値は必ず0以上1000以下の整数で返すこと。"
+)
+
+_COORDINATE_PROMPT = (
+    "画像内（赤枠があれば枠内）の図面から、参照画像（target.png）と同一形状の記号のみを検出。"
+    "回転やスケール差に頑健に対応し、誤検出を避ける。"
+)
+
+_FLEXIBLE_PROMPT = (
+    "赤枠内の図面から、参照画像（target.png）に似た円形で中に十字の記号を検出。"
+    "回転・スケール差に頑健。誤検出を避ける。"
+)
+
+# analyze_pdf_document の固定指示文（PDF本体より前に置き、全リクエストで同一の先頭部分にする）
+_PDF_BASE_PROMPT = (
+    "あなたは図面解析の専門アシスタントです。"
+    "次のPDFは建築図面です。各ページごとに以下を厳密に検出してください:\n"
+    "- 100mm径パイプシャフト（PF100）\n"
+    "- 防火ダンパー付き（FD付）の150mm径パイプシャフト（PF150）\n\n"
+    "出力要件:\n"
+    "- スキーマに沿ったJSONのみを返すこと（追加の説明文は返さない）\n"
+    "- 検出対象以外は含めない\n"
+    "- 座標は[0,1000]の範囲に正規化して返すこと。ページの左上を(0,0)、右下を(1000,1000)とする\n"
+    "- position.x, position.y は[0,1000]の整数で記録\n"
+    "- 矩形が分かる場合は bbox=[x,y,width,height] を[0,1000]の範囲で併記\n"
+    "- ページごとの件数と全体の件数をsummaryに集計\n"
+    "- 検出がなければ該当ページのdetectionsは空配列\n"
+    "- PF150( FD付 )は target='PF150_FD' として統一\n"
+)
+
+# analyze_images の一括リクエスト用スキーマ（ページ番号ごとの分析結果）
+_IMAGES_BATCH_SCHEMA: Dict[str, Any] = {
+    "type": "object",
+    "properties": {
+        "pages": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "page": {"type": "integer"},
+                    "result": {"type": "string"},
+                },
+                "required": ["page", "result"],
+            },
+        },
+    },
+    "required": ["pages"],
+}
+
+# analyze_pdf_document の出力スキーマ（Structured Output）
+_PDF_DETECTION_SCHEMA: Dict[str, Any] = {
+    "type": "object",
+    "properties": {
+        "summary": {
+            "type": "object",
+            "properties": {
+                "total_detections": {"type": "integer"},
+                "pf100_count": {"type": "integer"},
+                "pf150_fd_count": {"type": "integer"},
+                "notes": {"type": "string"},
+            },
+            "required": ["total_detections", "pf100_count", "pf150_fd_count"],
+        },
+        "pages": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "page": {"type": "integer"},
+                    "detections": {
+                        "type": "array",
+                        "items": {
+                            "type": "object",
+                            "properties": {
+                                "target": {
+                                    "type": "string",
+                                    "enum": ["PF100", "PF150_FD"],
+                                },
+                                "position": {
+                                    "type": "object",
+                                    "properties": {
+                                        "x": {"type": "integer", "minimum": 0, "maximum": 1000},
+                                        "y": {"type": "integer", "minimum": 0, "maximum": 1000},
+                                    },
+                                    "required": ["x", "y"],
+                                },
+                                "bbox": {
+                                    "type": "array",
+                                    "items": {"type": "integer", "minimum": 0, "maximum": 1000},
+                                    "minItems": 4,
+                                    "maxItems": 4,
+                                    "description": "[x, y, width, height] normalized to [0,1000]",
+                                },
+                                "confidence": {"type": "number"},
+                                "rationale": {"type": "string"},
+                            },
+                            "required": ["target", "position"],
+                        },
+                    },
+                },
+                "required": ["page", "detections"],
+            },
+        },
+    },
+    "required": ["summary", "pages"],
+}
+
+# analyze_symbol_with_coordinates の出力スキーマ
+_SYMBOL_DETECTION_SCHEMA: Dict[str, Any] = {
+    "type": "object",
+    "properties": {
+        "image_size": {
+            "type": "object",
+            "properties": {
+                "width": {"type": "integer"},
+                "height": {"type": "integer"},
+                "unit": {"type": "string", "enum": ["px"]},
+            },
+            "required": ["width", "height", "unit"],
+        },
+        "coordinate_space": {"type": "string", "enum": ["pixel"]},
+        "detections": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "symbol_type": {"type": "string"},
+                    "symbol_bbox": {
+                        "type": "array",
+                        "items": {"type": "number", "minimum": 0, "maximum": 1000},
+                        "minItems": 4,
+                        "maxItems": 4,
+                        "description": "[x, y, width, height] normalized to [0,1000]"
+                    },
+                    "box_2d": {
+                        "type": "array",
+                        "items": {"type": "number", "minimum": 0, "maximum": 1000},
+                        "minItems": 4,
+                        "maxItems": 4,
+                        "description": "[ymin, xmin, ymax, xmax] normalized to [0,1000]"
+                    },
+                    "confidence": {"type": "number"},
+                    "rationale": {"type": "string"},
+                    "matched_features": {
+                        "type": "array",
+                        "items": {"type": "string"},
+                    },
+                },
+                "required": ["confidence"],
+            },
+        },
+        "summary": {
+            "type": "object",
+            "properties": {
+                "total_detections": {"type": "integer"},
+                "notes": {"type": "string"},
+            },
+            "required": ["total_detections"],
+        },
+    },
+    "required": ["detections", "summary"],
+}
+
+# analyze_symbols_batch の出力スキーマ（ページ番号ごとの記号検出結果）
+_SYMBOL_BATCH_SCHEMA: Dict[str, Any] = {
+    "type": "object",
+    "properties": {
+        "pages": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "page": {"type": "integer"},
+                    "detections": _SYMBOL_DETECTION_SCHEMA["properties"]["detections"],
+                },
+                "required": ["page", "detections"],
+            },
+        },
+    },
+    "required": ["pages"],
+}
+
+# analyze_image_with_coordinates の出力スキーマ
+_COORDINATE_SCHEMA: Dict[str, Any] = {
+    "type": "object",
+    "properties": {
+        "detections": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "text": {"type": "string"},
+                    "symbol_bbox": {
+                        "type": "array",
+                        "items": {"type": "number"}
+                    },
+                    "box_2d": {
+                        "type": "array",
+                        "items": {"type": "number"}
+                    },
+                    "confidence": {"type": "number"},
+                    "rationale": {"type": "string"},
+                    "matched_features": {
+                        "type": "array",
+                        "items": {"type": "string"},
+                    },
+                },
+                "required": ["confidence"],
+            },
+        },
+        "summary": {
+            "type": "object",
+            "properties": {
+                "total_detections": {"type": "integer"}
+            },
+            "required": ["total_detections"],
+        },
+    },
+    "required": ["detections", "summary"],
+}
+
+# _retry_with_flexible_prompt の出力スキーマ
+_FLEXIBLE_SCHEMA: Dict[str, Any] = {
+    "type": "object",
+    "properties": {
+        "detections": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "text": {"type": "string"},
+                    "symbol_bbox": {
+                        "type": "array",
+                        "items": {"type": "number"}
+                    },
+                    "box_2d": {
+                        "type": "array",
+                        "items": {"type": "number"}
+                    },
+                    "confidence": {"type": "number"},
+                },
+                "required": ["confidence"],
+            },
+        },
+        "summary": {
+            "type": "object",
+            "properties": {
+                "total_detections": {"type": "integer"}
+            },
+            "required": ["total_detections"],
+        },
+    },
+    "required": ["detections", "summary"],
+}
+
+# analyze_pipe_shafts の出力スキーマ
+_PIPE_SHAFT_SCHEMA: Dict[str, Any] = {
+    "type": "object",
+    "properties": {
+        "summary": {
+            "type": "object",
+            "properties": {
+                "total_detections": {"type": "integer"},
+                "notes": {"type": "string"},
+            },
+            "required": ["total_detections"],
+        },
+        "pages": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "page": {"type": "integer"},
+                    "detections": {
+                        "type": "array",
+                        "items": {
+                            "type": "object",
+                            "properties": {
+                                "type": {
+                                    "type": "string",
+                                    "description": "パイプシャフトの種類（PF100, PF150など）",
+                                },
+                                "position": {
+                                    "type": "object",
+                                    "properties": {
+                                        "x": {"type": "integer", "minimum": 0, "maximum": 1000},
+                                        "y": {"type": "integer", "minimum": 0, "maximum": 1000},
+                                    },
+                                    "required": ["x", "y"],
+                                },
+                                "bbox": {
+                                    "type": "array",
+                                    "items": {"type": "integer", "minimum": 0, "maximum": 1000},
+                                    "minItems": 4,
+                                    "maxItems": 4,
+                                    "description": "[x, y, width, height] normalized to [0,1000]",
+                                },
+                                "confidence": {"type": "number"},
+                                "description": {"type": "string"},
+                            },
+                            "required": ["position"],
+                        },
+                    },
+                },
+                "required": ["page", "detections"],
+            },
+        },
+    },
+    "required": ["summary", "pages"],
+}
+
+# detect_target_image_in_pdf の出力スキーマ
+_TARGET_DETECTION_SCHEMA: Dict[str, Any] = {
+    "type": "object",
+    "properties": {
+        "summary": {
+            "type": "object",
+            "properties": {
+                "total_detections": {"type": "integer"},
+                "notes": {"type": "string"},
+            },
+            "required": ["total_detections"],
+        },
+        "pages": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "page": {"type": "integer"},
+                    "detections": {
+                        "type": "array",
+                        "items": {
+                            "type": "object",
+                            "properties": {
+                                "position": {
+                                    "type": "object",
+                                    "properties": {
+                                        "x": {"type": "integer", "minimum": 0, "maximum": 1000},
+                                        "y": {"type": "integer", "minimum": 0, "maximum": 1000},
+                                    },
+                                    "required": ["x", "y"],
+                                },
+                                "confidence": {"type": "number"},
+                                "description": {"type": "string"},
+                            },
+                            "required": ["position"],
+                        },
+                    },
+                },
+                "required": ["page", "detections"],
+            },
+        },
+    },
+    "required": ["summary", "pages"],
+}
+
+# 構造化出力の生成設定（不変なので呼び出しごとに組み立てず共有する）
+_IMAGES_BATCH_GEN_CONFIG = types.GenerateContentConfig(
+    response_mime_type="application/json",
+    response_schema=_IMAGES_BATCH_SCHEMA,
+)
+_PDF_GEN_CONFIG = types.GenerateContentConfig(
+    response_mime_type="application/json",
+    response_schema=_PDF_DETECTION_SCHEMA,
+)
+_SYMBOL_GEN_CONFIG = types.GenerateContentConfig(
+    response_mime_type="application/json",
+    response_schema=_SYMBOL_DETECTION_SCHEMA,
+)
+_SYMBOL_BATCH_GEN_CONFIG = types.GenerateContentConfig(
+    response_mime_type="application/json",
+    response_schema=_SYMBOL_BATCH_SCHEMA,
+)
+_COORDINATE_GEN_CONFIG = types.GenerateContentConfig(
+    response_mime_type="application/json",
+    response_schema=_COORDINATE_SCHEMA,
+)
+_FLEXIBLE_GEN_CONFIG = types.GenerateContentConfig(
+    response_mime_type="application/json",
+    response_schema=_FLEXIBLE_SCHEMA,
+)
+_PIPE_SHAFT_GEN_CONFIG = types.GenerateContentConfig(
+    response_mime_type="application/json",
+    response_schema=_PIPE_SHAFT_SCHEMA,
+)
+_TARGET_GEN_CONFIG = types.GenerateContentConfig(
+    response_mime_type="application/json",
+    response_schema=_TARGET_DETECTION_SCHEMA,
+)
+
+
+# ---- ページ単位検出結果の検証モデル（パイプシャフト・ターゲット検出） ----------
+# スキーマ外のフィールド（type, bbox, description など）はそのまま保持する
+def _clamp_normalized(value: Any) -> Any:
+    """Round and clamp a numeric coordinate into [0,1000]; leave others to pydantic."""
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return min(1000, max(0, int(round(value))))
+    return value
+
+
+class _Position(BaseModel):
+    model_config = ConfigDict(extra="allow")
+
+    x: Annotated[int, BeforeValidator(_clamp_normalized)]
+    y: Annotated[int, BeforeValidator(_clamp_normalized)]
+
+
+class _PageDetection(BaseModel):
+    model_config = ConfigDict(extra="allow")
+
+    position: _Position
+    confidence: Optional[float] = None
+
+
+class _PageResult(BaseModel):
+    model_config = ConfigDict(extra="allow")
+
+    page: int
+    detections: List[_PageDetection] = []
+
+
+class _PagesSummary(BaseModel):
+    model_config = ConfigDict(extra="allow")
+
+    total_detections: int
+
+
+class _PagesResult(BaseModel):
+    model_config = ConfigDict(extra="allow")
+
+    summary: _PagesSummary
+    pages: List[_PageResult]
+
+
+def _validate_pages_result(data: Any) -> Optional[Dict[str, Any]]:
+    """Validate a {summary, pages} detection result; None when it does not conform."""
+    try:
+        return _PagesResult.model_validate(data).model_dump(exclude_none=True)
+    except ValidationError:
+        return None
+
+
+# ---- 記号検出の一括応答（analyze_symbols_batch）の検証モデル ------------------
+_NormalizedBox = Annotated[
+    List[Annotated[int, BeforeValidator(_clamp_normalized)]],
+    Field(min_length=4, max_length=4),
+]
+
+
+class _SymbolDetection(BaseModel):
+    model_config = ConfigDict(extra="allow")
+
+    symbol_bbox: Optional[_NormalizedBox] = None
+    box_2d: Optional[_NormalizedBox] = None
+    confidence: Optional[float] = None
+
+
+class _SymbolPage(BaseModel):
+    model_config = ConfigDict(extra="allow")
+
+    page: int
+    detections: List[_SymbolDetection] = []
+
+
+class _SymbolBatchResult(BaseModel):
+    model_config = ConfigDict(extra="allow")
+
+    pages: List[_SymbolPage]
+
+
+def _validate_symbol_batch(data: Any) -> Optional[Dict[str, Any]]:
+    """Validate a {pages: [{page, detections}]} symbol batch; None when it does not conform."""
+    try:
+        return _SymbolBatchResult.model_validate(data).model_dump(exclude_none=True)
+    except ValidationError:
+        return None
+
+# プロンプトを変更した場合はキャッシュを無効化するためにバージョンを更新する
+_COORDINATE_PROMPT_VERSION = "v1"
+# 解析結果キャッシュ（メモリ層・ディスク層）用。プロンプトやスキーマを変えたら更新する
+_PDF_PROMPT_VERSION = "v1"
+_SYMBOL_PROMPT_VERSION = "v1"
+_PIPE_SHAFT_PROMPT_VERSION = "v1"
+_TARGET_PROMPT_VERSION = "v3"
+
+
+class _LRUCache:
+    """Small in-process LRU cache for parsed Gemini responses.
+
+    Values are deep-copied on the way in and out so callers can freely mutate
+    the returned dicts (e.g. attach ``_debug``) without poisoning the cache.
+    """
+
+    def __init__(self, max_entries: int = 256):
+        self.max_entries = max_entries
+        self._data: "OrderedDict[str, Any]" = OrderedDict()
+
+    def get(self, key: str) -> Optional[Any]:
+        if key not in self._data:
+            return None
+        self._data.move_to_end(key)
+        return copy.deepcopy(self._data[key])
+
+    def put(self, key: str, value: Any) -> None:
+        self._data[key] = copy.deepcopy(value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.max_entries:
+            self._data.popitem(last=False)
+
+
+# 同梱のデフォルトターゲット画像
+_DEFAULT_TARGET_IMAGE_PATH = (
+    pathlib.Path(__file__).parent.parent / "assets" / "images" / "target.png"
+)
+
+
+@functools.lru_cache(maxsize=1)
+def _default_target_image() -> Image.Image:
+    """Open and decode the bundled target.png once per process.
+
+    The returned image is shared; callers only read it (encoding makes copies).
+    """
+    if not _DEFAULT_TARGET_IMAGE_PATH.exists():
+        raise FileNotFoundError(f"Target image not found: {_DEFAULT_TARGET_IMAGE_PATH}")
+    image = Image.open(_DEFAULT_TARGET_IMAGE_PATH)
+    image.load()
+    return image
+
+
+def _symbol_detection_prompt(target_description: Optional[str]) -> str:
+    """Symbol prompt: the fixed instructions first, the optional target notes last."""
+    # 不変の指示文を先頭に置き、可変部分（ターゲット説明）は末尾にのみ付加する
+    if not target_description:
+        return _SYMBOL_DETECTION_PROMPT
+    return f"{_SYMBOL_DETECTION_PROMPT}\n参考となるターゲットの特徴:\n{target_description}\n"
+
+
+# 画像1タイル(768x768相当)あたりの入力トークン数と、一括送信する画像トークンの上限
+_IMAGE_TOKENS_PER_TILE = 258
+_BATCH_IMAGE_TOKEN_BUDGET = 64_000
+
+
+def _estimate_image_tokens(width: int, height: int) -> int:
+    """Approximate Gemini input tokens for an image of the given size.
+
+    Images up to 384 px on both sides cost one tile; larger ones are cut into
+    square tiles of min(w, h) / 1.5 px (clamped to 256..768), 258 tokens each.
+    """
+    if width <= 384 and height <= 384:
+        return _IMAGE_TOKENS_PER_TILE
+    tile = max(256, min(768, int(min(width, height) / 1.5)))
+    return math.ceil(width / tile) * math.ceil(height / tile) * _IMAGE_TOKENS_PER_TILE
+
+
+# 画像フィンガープリントでハッシュする最大画素数（これを超える画像は縮小してからハッシュ）
+_FINGERPRINT_MAX_PIXELS = 1_000_000
+
+
+def _image_fingerprint(image: Image.Image) -> str:
+    """Content hash of a PIL image (mode and size included, since tobytes() omits them).
+
+    Large pages are BOX-reduced by an integer factor before hashing so only
+    ~1 MP is copied out and hashed instead of the full raster. Every source
+    pixel still contributes to a block average, so unlike point sampling a
+    changed label or symbol still changes the key.
+    """
+    width, height = image.size
+    h = hashlib.blake2b(digest_size=16)
+    h.update(f"{image.mode}:{width}x{height}:".encode())
+    factor = math.isqrt(width * height // _FINGERPRINT_MAX_PIXELS)
+    if factor > 1 and image.mode not in ("1", "P"):
+        image = image.reduce(factor)
+    h.update(image.tobytes())
+    return h.hexdigest()
+
+
+def _image_fingerprints(images: List[Image.Image]) -> List[str]:
+    """Fingerprint several images in one call (run via asyncio.to_thread)."""
+    return [_image_fingerprint(image) for image in images]
+
+
+@functools.lru_cache(maxsize=None)
+def _get_client(api_key: str) -> genai.Client:
+    """Return a process-wide google.genai client for the key (reuses its HTTP pool).
+
+    The async httpx pool is sized for the concurrent per-page fan-out so
+    keep-alive connections are reused instead of paying a TLS handshake
+    per request.
+    """
+    return genai.Client(
+        api_key=api_key,
+        http_options=types.HttpOptions(
+            timeout=_HTTP_TIMEOUT_MS,
+            async_client_args={
+                "limits": httpx.Limits(
+                    max_connections=_HTTP_MAX_CONNECTIONS,
+                    max_keepalive_connections=_HTTP_MAX_KEEPALIVE_CONNECTIONS,
+                ),
+            },
+        ),
+    )
+
+
+def load_api_keys() -> List[str]:
+    """Collect Gemini API keys from the environment.
+
+    Sources (deduplicated, in order): GEMINI_API_KEY, the comma-separated
+    GEMINI_API_KEYS, then GEMINI_API_KEY_1..N until the first gap.
+    """
+    keys: List[str] = []
+    single = os.getenv("GEMINI_API_KEY")
+    if single:
+        keys.append(single.strip())
+    keys.extend(k.strip() for k in os.getenv("GEMINI_API_KEYS", "").split(",") if k.strip())
+    i = 1
+    while key := os.getenv(f"GEMINI_API_KEY_{i}"):
+        keys.append(key.strip())
+        i += 1
+    return list(dict.fromkeys(k for k in keys if k))
+
+
+class _ApiKeyPool:
+    """Rotates requests over several API keys (one per GCP project).
+
+    Each key tracks a 429 cooldown and, when ``rpm_per_key`` is set, a token
+    bucket refilled at rpm/60 tokens per second. ``acquire`` hands out the key
+    that becomes available soonest (round-robin among ties) and sleeps only
+    when every key is cooling down or out of tokens.
+    """
+
+    def __init__(self, keys: List[str], rpm_per_key: Optional[int] = None):
+        now = time.monotonic()
+        self.keys = list(keys)
+        self.rpm_per_key = rpm_per_key
+        self._cooldown_until = {k: 0.0 for k in self.keys}
+        self._tokens = {k: float(rpm_per_key or 0) for k in self.keys}
+        self._refilled_at = {k: now for k in self.keys}
+        self._next = 0
+
+    def _ready_at(self, key: str, now: float) -> float:
+        ready = self._cooldown_until[key]
+        if self.rpm_per_key:
+            elapsed = now - self._refilled_at[key]
+            self._tokens[key] = min(
+                float(self.rpm_per_key),
+                self._tokens[key] + elapsed * self.rpm_per_key / 60.0,
+            )
+            self._refilled_at[key] = now
+            if self._tokens[key] < 1:
+                ready = max(ready, now + (1 - self._tokens[key]) * 60.0 / self.rpm_per_key)
+        return max(ready, now)
+
+    async def acquire(self) -> str:
+        now = time.monotonic()
+        order = self.keys[self._next:] + self.keys[: self._next]
+        ready = {k: self._ready_at(k, now) for k in order}
+        key = min(order, key=ready.__getitem__)
+        self._next = (self.keys.index(key) + 1) % len(self.keys)
+        if ready[key] > now:
+            await asyncio.sleep(ready[key] - now)
+        if self.rpm_per_key:
+            self._tokens[key] -= 1
+        return key
+
+    def mark_rate_limited(self, key: str, delay: float) -> None:
+        self._cooldown_until[key] = max(self._cooldown_until[key], time.monotonic() + delay)
+
+
+@functools.lru_cache(maxsize=None)
+def _get_key_pool(keys: tuple, rpm_per_key: Optional[int]) -> _ApiKeyPool:
+    """Process-wide pool per key set, so cooldowns survive across analyzer instances."""
+    return _ApiKeyPool(list(keys), rpm_per_key)
+
+
+def _detection_raw_bbox(det: Dict[str, Any]) -> Any:
+    """Return the first bbox representation present on a detection dict.
+
+    Preference order: symbol_bbox, bbox, box_2d (wrapped for _to_pixel_bbox), box.
+    """
+    for key in ("symbol_bbox", "bbox"):
+        value = det.get(key)
+        if value:
+            return value
+    box_2d = det.get("box_2d")
+    if box_2d is not None:
+        return {"box_2d": box_2d}
+    return det.get("box")
+
+
+def _clip_and_pack(x: float, y: float, w: float, h: float, img_w: int, img_h: int):
+    """Round a pixel bbox and clip it to the image; None when it is empty."""
+    x, y, w, h = int(round(x)), int(round(y)), int(round(w)), int(round(h))
+    if w <= 0 or h <= 0:
+        return None
+    x = max(0, min(x, img_w - 1))
+    y = max(0, min(y, img_h - 1))
+    w = max(1, min(w, img_w - x))
+    h = max(1, min(h, img_h - y))
+    return x, y, w, h
+
+
+def _flatten_to_rgb(image: Image.Image) -> Image.Image:
+    """Convert to RGB for JPEG, compositing any transparency onto white (not black)."""
+    if image.mode == "RGB":
+        return image
+    if image.mode in ("RGBA", "LA") or (image.mode == "P" and "transparency" in image.info):
+        rgba = image.convert("RGBA")
+        background = Image.new("RGB", rgba.size, (255, 255, 255))
+        background.paste(rgba, mask=rgba.getchannel("A"))
+        return background
+    return image.convert("RGB")
+
+
+def _is_rate_limited(exc: Exception) -> bool:
+    """Return True when the exception represents a Gemini 429 / RESOURCE_EXHAUSTED.
+
+    The HTTP code / status of the exception (or the error it wraps) decides;
+    the message is only inspected when no such attribute is available.
+    """
+    err: Optional[BaseException] = exc
+    while err is not None:
+        if getattr(err, "status", None) == "RESOURCE_EXHAUSTED":
+            return True
+        code = getattr(err, "code", None)
+        if isinstance(code, int):
+            return code == 429
+        err = err.__cause__
+    text = str(exc)
+    return re.search(r"\b429\b", text) is not None or "RESOURCE_EXHAUSTED" in text
+
+
+# 構造化出力の指定（response_schema / response_mime_type）自体が拒否されたことを示す文言
+_STRUCTURED_OUTPUT_ERROR_MARKERS = (
+    "response_schema",
+    "responseschema",
+    "response_mime_type",
+    "responsemimetype",
+    "json mode",
+)
+
+
+def _is_structured_output_rejection(exc: Exception) -> bool:
+    """Return True for a 400 whose message is about response_schema / response_mime_type."""
+    if not isinstance(exc, errors.ClientError) or exc.code != 400:
+        return False
+    text = f"{exc.message or ''} {exc}".lower()
+    return any(marker in text for marker in _STRUCTURED_OUTPUT_ERROR_MARKERS)
+
+
+def _is_server_error(exc: Exception) -> bool:
+    """Return True for transient Gemini 5xx errors."""
+    return isinstance(exc, errors.APIError) and (exc.code or 0) >= 500
+
+
+def _retry_after_seconds(exc: Exception) -> Optional[float]:
+    """Extract a Retry-After header (seconds) from the exception's HTTP response, if any."""
+    headers = getattr(getattr(exc, "response", None), "headers", None)
+    if not headers:
+        return None
+    try:
+        value = headers.get("retry-after")
+        return max(0.0, float(value)) if value is not None else None
+    except (TypeError, ValueError):
+        return None
 
 
 class GeminiImageAnalyzer:
@@ -12,46 +870,313 @@ class GeminiImageAnalyzer:
     Gemini APIを使用した画像分析クラス
     """
 
-    def __init__(self, model_name: str = "gemini-2.5-pro"):
+    # リクエストごとにインスタンスが作られるため、キャッシュはクラス単位で共有する
+    _coordinate_cache = _LRUCache(max_entries=256)
+    _analysis_cache = _LRUCache(max_entries=256)
+    # 明示的コンテキストキャッシュ: 出現済みPDFの記録と、(APIキー, モデル, 内容)ごとのキャッシュ名
+    _context_cache_seen = _LRUCache(max_entries=256)
+    _context_caches = _LRUCache(max_entries=64)
+
+    def __init__(
+        self,
+        model_name: str = "gemini-2.5-pro",
+        max_concurrency: int = 4,
+        max_image_dim: Optional[int] = 1536,
+        api_keys: Optional[List[str]] = None,
+        upload_quality: Optional[int] = 85,
+    ):
         """
         GeminiImageAnalyzerの初期化
-        環境変数GEMINI_API_KEYからAPIキーを取得
+        環境変数GEMINI_API_KEY（複数キーはGEMINI_API_KEYS / GEMINI_API_KEY_1..N）からAPIキーを取得
 
         Args:
             model_name: 使用するGeminiモデル名（デフォルト: gemini-2.5-pro）
+            max_concurrency: 複数画像分析時の同時リクエスト数上限（RPM制限に合わせて調整）
+            max_image_dim: 送信前に画像の長辺をこのピクセル数以下へ縮小する（Noneで無効）
+            api_keys: 使用するAPIキーのリスト（省略時は環境変数から取得、複数指定でローテーション）
+            upload_quality: 送信画像のJPEG品質（Noneで可逆PNG送信、デバッグ用）
         """
-        api_key = os.getenv("GEMINI_API_KEY")
-        if not api_key:
+        keys = list(api_keys) if api_keys else load_api_keys()
+        if not keys:
             raise ValueError("GEMINI_API_KEY environment variable is not set")
 
-        # New google.genai client
-        self.client = genai.Client(api_key=api_key)
+        rpm = os.getenv("GEMINI_RPM_PER_KEY")
+        self._key_pool = _get_key_pool(tuple(keys), int(rpm) if rpm else None)
+
+        # New google.genai client（プロセス内で共有）
+        self.client = _get_client(keys[0])
         self.model_name = model_name
+        self._structured_supported = model_name.startswith(_STRUCTURED_OUTPUT_MODEL_PREFIXES)
+        self.max_concurrency = max(1, max_concurrency)
+        self.max_image_dim = max_image_dim
+        self.upload_quality = upload_quality
+        # エンコード済みのデフォルトtarget.png（送信設定に依存するためインスタンス単位）
+        self._default_target_part: Optional[types.Part] = None
+        # 解析結果のキャッシュ（メモリLRU＋GEMINI_CACHE_DIR指定時はディスク）
+        # GEMINI_CACHE_DIR未設定かつGEMINI_CACHE_MEMORY_ENTRIES<=0のときのみNone
+        self._extraction_cache = get_extraction_cache()
 
     # ---- Payload builders (google.genai) -------------------------------
-    def _pil_to_part(self, image: Image.Image, mime_type: str = "image/png") -> types.Part:
-        import io
+    def _pil_to_part(
+        self,
+        image: Image.Image,
+        mime_type: Optional[str] = None,
+        max_dim: Optional[int] = None,
+    ) -> types.Part:
+        """Encode a PIL image as an upload Part.
+
+        max_dim overrides the instance's max_image_dim for this call
+        (None: use max_image_dim, 0: send at full resolution).
+        """
+        if mime_type is None:
+            # 1bit/パレット画像（線画）はPNGの方が小さく劣化もないためPNGのまま送る
+            lossless = not self.upload_quality or image.mode in ("1", "P")
+            mime_type = "image/png" if lossless else "image/jpeg"
+
+        # Gemini bills image tokens by tile count; shrink oversized rasters first.
+        # Coordinates are requested in the normalized [0,1000] space, so no
+        # rescaling of the returned boxes is needed afterwards.
+        if max_dim is None:
+            max_dim = self.max_image_dim
+        if max_dim and max(image.size) > max_dim:
+            scale = max_dim / max(image.size)
+            # reducing_gap: 整数倍の縮小を先に行い、LANCZOSは最後の数倍分だけに掛ける
+            image = image.resize(
+                (max(1, int(image.width * scale)), max(1, int(image.height * scale))),
+                Image.Resampling.LANCZOS,
+                reducing_gap=3.0,
+            )
 
         buf = io.BytesIO()
-        # Use PNG to avoid JPEG artifacts for diagrams
-        fmt = "PNG" if mime_type == "image/png" else "JPEG"
-        image.save(buf, format=fmt)
+        if mime_type == "image/png":
+            # zlibレベル1はデフォルト(6)より数倍速く、サイズ増は1割程度
+            image.save(buf, format="PNG", compress_level=1)
+        else:
+            # JPEG encodes several times faster than PNG and is far smaller for
+            # rasterised drawing pages; q=85 keeps thin symbol strokes intact.
+            _flatten_to_rgb(image).save(
+                buf,
+                format="JPEG",
+                quality=self.upload_quality or 85,
+                optimize=False,
+                progressive=False,
+            )
         return types.Part.from_bytes(data=buf.getvalue(), mime_type=mime_type)
 
-    def _build_contents(self, prompt: str, *images: Image.Image) -> List[types.Content]:
-        parts: List[types.Part] = [types.Part.from_text(text=prompt)]
-        for img in images:
-            parts.append(self._pil_to_part(img))
-        return [types.Content(role="user", parts=parts)]
+    async def _encode_parts(self, *images: Image.Image) -> List[types.Part]:
+        """Encode images concurrently in worker threads.
+
+        Pillow releases the GIL while resizing and encoding, so pages are
+        prepared in parallel and the event loop stays free.
+        """
+        return list(
+            await asyncio.gather(
+                *(asyncio.to_thread(self._pil_to_part, img) for img in images)
+            )
+        )
+
+    def _build_contents_with_parts(
+        self, prompt: str, *parts: types.Part
+    ) -> List[types.Content]:
+        """Single user turn: the prompt text followed by already-encoded parts."""
+        return [
+            types.Content(role="user", parts=[types.Part.from_text(text=prompt), *parts])
+        ]
+
+    def _target_part(self, target_image: Image.Image) -> types.Part:
+        """Encoded Part for the target image; the bundled target.png is encoded once."""
+        # 未読込なら渡された画像はカスタム画像（target.pngが無い環境でも読み込みを試みない）
+        is_default = (
+            _default_target_image.cache_info().currsize > 0
+            and target_image is _default_target_image()
+        )
+        if not is_default:
+            return self._pil_to_part(target_image)
+        if self._default_target_part is None:
+            self._default_target_part = self._pil_to_part(target_image)
+        return self._default_target_part
 
     # ---- Internal helpers -------------------------------------------------
-    def _extract_structured(self, response) -> Optional[Dict[str, Any]]:
+    async def _context_cache_name(
+        self, api_key: str, context_cache: Dict[str, Any]
+    ) -> Optional[str]:
+        """Return a live explicit-cache name for this key, creating it if needed.
+
+        Caches belong to the project behind an API key, so entries are keyed by
+        (key, model, content id). Creation failures (content below the model's
+        minimum token count, unsupported model, ...) are remembered until the
+        TTL passes so they are not retried on every request; None means the
+        caller should send the full uncached request.
+        """
+        key_id = hashlib.blake2b(api_key.encode(), digest_size=8).hexdigest()
+        entry_key = f"{key_id}:{self.model_name}:{context_cache['id']}"
+        now = time.monotonic()
+        entry = self._context_caches.get(entry_key)
+        if entry is not None and entry["expires_at"] > now:
+            return entry["name"]
+
+        try:
+            cache = await _get_client(api_key).aio.caches.create(
+                model=self.model_name,
+                config=types.CreateCachedContentConfig(
+                    contents=context_cache["contents"],
+                    system_instruction=context_cache["system_instruction"],
+                    ttl=f"{_CONTEXT_CACHE_TTL_S}s",
+                ),
+            )
+            name = cache.name
+        except Exception:
+            logging.getLogger("pdf_highlight_api.gemini").info(
+                "Explicit context cache unavailable for %s; sending uncached request",
+                context_cache["id"],
+                exc_info=True,
+            )
+            name = None
+        self._context_caches.put(
+            entry_key,
+            {
+                "name": name,
+                "expires_at": now + _CONTEXT_CACHE_TTL_S - _CONTEXT_CACHE_EXPIRY_MARGIN_S,
+            },
+        )
+        return name
+
+    async def _generate(self, context_cache: Optional[Dict[str, Any]] = None, **kwargs):
+        """Call the async generate_content, retrying 429s and 5xx with backoff.
+
+        Each attempt takes a key from the shared key pool. On a 429 that key is
+        put into cooldown for base * 2**attempt scaled by a random factor in
+        [0.75, 1.25] (or the Retry-After header when present) and the next
+        attempt goes to whichever key is available soonest; with a single key
+        this is a plain backoff sleep. 5xx errors are retried on the next key
+        after a linear base * (attempt + 1) sleep. Other errors and the final
+        failed attempt are re-raised.
+
+        With ``context_cache`` ({"id", "system_instruction", "contents",
+        "request_contents"}), the cached prefix is looked up for the chosen key
+        and, when available, only ``request_contents`` is sent with
+        ``cached_content`` set; otherwise ``kwargs`` is sent unchanged.
+        """
+        for attempt in range(_RETRY_MAX_ATTEMPTS):
+            api_key = await self._key_pool.acquire()
+            call_kwargs = kwargs
+            if context_cache is not None:
+                cache_name = await self._context_cache_name(api_key, context_cache)
+                if cache_name:
+                    config = kwargs.get("config") or types.GenerateContentConfig()
+                    call_kwargs = {
+                        **kwargs,
+                        "contents": context_cache["request_contents"],
+                        "config": config.model_copy(update={"cached_content": cache_name}),
+                    }
+            try:
+                response = await _get_client(api_key).aio.models.generate_content(
+                    model=self.model_name, **call_kwargs
+                )
+            except Exception as e:
+                if attempt == _RETRY_MAX_ATTEMPTS - 1:
+                    raise
+                if _is_server_error(e):
+                    # 一時的なサーバーエラー: キーは健全なのでクールダウンせず待ってから再送
+                    delay = _RETRY_BASE_BACKOFF_S * (attempt + 1)
+                    logging.getLogger("pdf_highlight_api.gemini").warning(
+                        "Gemini server error %s (attempt %d/%d); retrying in %.2fs",
+                        getattr(e, "code", None),
+                        attempt + 1,
+                        _RETRY_MAX_ATTEMPTS,
+                        delay,
+                    )
+                    await asyncio.sleep(delay)
+                    continue
+                if not _is_rate_limited(e):
+                    raise
+                delay = _retry_after_seconds(e)
+                if delay is None:
+                    delay = (
+                        _RETRY_BASE_BACKOFF_S
+                        * (2**attempt)
+                        * random.uniform(0.75, 1.25)
+                    )
+                self._key_pool.mark_rate_limited(api_key, delay)
+                logging.getLogger("pdf_highlight_api.gemini").warning(
+                    "Gemini rate limited (attempt %d/%d, key %d/%d); cooling key down for %.2fs",
+                    attempt + 1,
+                    _RETRY_MAX_ATTEMPTS,
+                    self._key_pool.keys.index(api_key) + 1,
+                    len(self._key_pool.keys),
+                    delay,
+                )
+                continue
+
+            # 暗黙的/明示的キャッシュのヒット状況を確認できるようトークン数を記録
+            usage = getattr(response, "usage_metadata", None)
+            if usage is not None:
+                logging.getLogger("pdf_highlight_api.gemini").debug(
+                    "Gemini usage: prompt_tokens=%s cached_tokens=%s",
+                    getattr(usage, "prompt_token_count", None),
+                    getattr(usage, "cached_content_token_count", None),
+                )
+            return response
+
+    async def _generate_structured(
+        self,
+        contents: List[types.Content],
+        config: types.GenerateContentConfig,
+        fallback_contents: Callable[[], List[types.Content]],
+        context_cache: Optional[Dict[str, Any]] = None,
+    ):
+        """Generate with a response schema, falling back to a schema-less request.
+
+        Whether the model accepts response_schema is learned once per model:
+        after a 400 that names the schema / JSON mime type the schema attempt
+        is skipped, other 4xx errors propagate, and once a schema request
+        succeeded, failures propagate instead of re-sending.
+        """
+        supported = self._structured_supported or _structured_output_support.get(
+            self.model_name
+        )
+        rejected = False
+        if supported is not False:
+            try:
+                response = await self._generate(
+                    context_cache=context_cache, contents=contents, config=config
+                )
+            except Exception as e:
+                # レート制限や構造化出力対応モデルでの失敗、スキーマ以外が原因の4xxは、
+                # スキーマなしで再送しても解決しないため、二重にリクエストせずそのまま伝播する
+                rejected = _is_structured_output_rejection(e)
+                if (
+                    _is_rate_limited(e)
+                    or supported
+                    or (isinstance(e, errors.ClientError) and not rejected)
+                ):
+                    raise
+            else:
+                if supported is None:
+                    _structured_output_support[self.model_name] = True
+                return response
+
+        response = await self._generate(contents=fallback_contents())
+        if rejected:
+            # スキーマなしでは成功したので、このモデルは構造化出力未対応として記録する
+            _structured_output_support[self.model_name] = False
+            logging.getLogger("pdf_highlight_api.gemini").info(
+                "Structured output rejected by %s; sending schema-less requests from now on",
+                self.model_name,
+            )
+        return response
+
+    def _extract_structured(
+        self, response, text: Optional[str] = None
+    ) -> Optional[Dict[str, Any]]:
         """Extract structured JSON from Gemini response with multiple fallbacks.
 
-        Order:
+        Order (cheapest first; the parts walk only runs when both fail):
         1) response.parsed (SDK structured output)
-        2) response.candidates[].content.parts[].inline_data (application/json)
-        3) response.text (parse as JSON)
+        2) response.text (parse as JSON)
+        3) response.candidates[].content.parts[].inline_data (application/json)
+        text lets callers pass response.text they already read, since each
+        access re-joins the candidate parts inside the SDK.
         Returns dict or None.
         """
         try:
@@ -59,40 +1184,38 @@ class GeminiImageAnalyzer:
             parsed = getattr(response, "parsed", None)
             if parsed is not None:
                 try:
-                    # pydantic model or plain dict
-                    if hasattr(parsed, "model_dump"):
-                        return parsed.model_dump()
+                    # dict スキーマではSDKがdictをそのまま返すため、コピーせずに使う
                     if isinstance(parsed, (dict, list)):
                         return parsed  # type: ignore[return-value]
+                    # pydantic model: None のフィールドは出力しない
+                    if hasattr(parsed, "model_dump"):
+                        return parsed.model_dump(mode="python", exclude_none=True)
                 except Exception:
                     pass
 
-            # 2) Inline JSON in parts
-            candidates = getattr(response, "candidates", None) or []
-            for c in candidates:
-                content = getattr(c, "content", None)
-                parts = getattr(content, "parts", None) or []
-                for p in parts:
-                    inline = getattr(p, "inline_data", None)
-                    if inline is not None:
-                        mime = getattr(inline, "mime_type", "") or ""
-                        data = getattr(inline, "data", b"")
-                        if "json" in mime:
-                            try:
-                                if isinstance(data, (bytes, bytearray)):
-                                    return json.loads(data.decode("utf-8"))
-                                if isinstance(data, str):
-                                    return json.loads(data)
-                            except Exception:
-                                pass
-
-            # 3) Fallback to text JSON
-            text = getattr(response, "text", None)
-            if isinstance(text, str) and text.strip():
+            # 2) Text JSON (strip ```json fences emitted without structured output)
+            if text is None:
+                text = getattr(response, "text", None)
+            if isinstance(text, str) and text:
                 try:
-                    return json.loads(text)
+                    return _json_loads(_strip_code_fence(text))
                 except Exception:
-                    return None
+                    pass
+
+            # 3) Inline JSON in parts
+            for c in getattr(response, "candidates", None) or []:
+                content = getattr(c, "content", None)
+                for p in getattr(content, "parts", None) or []:
+                    inline = getattr(p, "inline_data", None)
+                    if inline is None or "json" not in (getattr(inline, "mime_type", "") or ""):
+                        continue
+                    data = getattr(inline, "data", b"")
+                    # orjson / json.loads はbytesをそのまま受け付けるためデコード不要
+                    if isinstance(data, (bytes, bytearray, str)):
+                        try:
+                            return _json_loads(data)
+                        except Exception:
+                            pass
         except Exception:
             return None
 
@@ -111,49 +1234,40 @@ class GeminiImageAnalyzer:
         if not raw_bbox:
             return None
 
-        def clip_and_pack(x, y, w, h):
-            x, y, w, h = int(round(x)), int(round(y)), int(round(w)), int(round(h))
-            if w <= 0 or h <= 0:
-                return None
-            x = max(0, min(x, img_w - 1))
-            y = max(0, min(y, img_h - 1))
-            w = max(1, min(w, img_w - x))
-            h = max(1, min(h, img_h - y))
-            return x, y, w, h
+        # [0,1000] -> pixels scale, computed once per bbox
+        sx, sy = img_w / 1000.0, img_h / 1000.0
 
         if isinstance(raw_bbox, dict):
             if "box_2d" in raw_bbox and isinstance(raw_bbox["box_2d"], (list, tuple)) and len(raw_bbox["box_2d"]) >= 4:
                 ymin, xmin, ymax, xmax = raw_bbox["box_2d"][:4]
                 # Always expect [0,1000] normalized coordinates
-                sx, sy = img_w / 1000.0, img_h / 1000.0
                 x1, y1 = xmin * sx, ymin * sy
                 x2, y2 = xmax * sx, ymax * sy
-                return clip_and_pack(x1, y1, x2 - x1, y2 - y1)
+                return _clip_and_pack(x1, y1, x2 - x1, y2 - y1, img_w, img_h)
 
             if all(k in raw_bbox for k in ("x", "y", "w", "h")):
                 x, y, w, h = raw_bbox["x"], raw_bbox["y"], raw_bbox["w"], raw_bbox["h"]
                 # Convert from [0,1000] to pixels
-                x, y, w, h = x * img_w / 1000, y * img_h / 1000, w * img_w / 1000, h * img_h / 1000
-                return clip_and_pack(x, y, w, h)
+                return _clip_and_pack(x * sx, y * sy, w * sx, h * sy, img_w, img_h)
 
             if all(k in raw_bbox for k in ("x1", "y1", "x2", "y2")):
                 x1, y1, x2, y2 = raw_bbox["x1"], raw_bbox["y1"], raw_bbox["x2"], raw_bbox["y2"]
                 # Convert from [0,1000] to pixels
-                x1, y1, x2, y2 = x1 * img_w / 1000, y1 * img_h / 1000, x2 * img_w / 1000, y2 * img_h / 1000
-                return clip_and_pack(x1, y1, x2 - x1, y2 - y1)
+                x1, y1, x2, y2 = x1 * sx, y1 * sy, x2 * sx, y2 * sy
+                return _clip_and_pack(x1, y1, x2 - x1, y2 - y1, img_w, img_h)
 
             return None
 
         if isinstance(raw_bbox, (list, tuple)) and len(raw_bbox) >= 4:
             a, b, c, d = raw_bbox[:4]
             # Always expect [0,1000] normalized
-            a, b, c, d = a * img_w / 1000, b * img_h / 1000, c * img_w / 1000, d * img_h / 1000
+            a, b, c, d = a * sx, b * sy, c * sx, d * sy
 
             # Heuristic: treat as [x1,y1,x2,y2] if c>a and d>b
             if c > a and d > b:
-                return clip_and_pack(a, b, c - a, d - b)
+                return _clip_and_pack(a, b, c - a, d - b, img_w, img_h)
             # Otherwise [x,y,w,h]
-            return clip_and_pack(a, b, c, d)
+            return _clip_and_pack(a, b, c, d, img_w, img_h)
 
         return None
 
@@ -169,22 +1283,12 @@ class GeminiImageAnalyzer:
         Returns:
             dict: 説明結果と画像メタ情報
         """
-        import pathlib
-
         # ターゲット画像の決定（カスタム優先、なければデフォルト）
         source = "custom" if custom_target_image is not None else "default"
         if custom_target_image is not None:
             target_image = custom_target_image
         else:
-            target_image_path = (
-                pathlib.Path(__file__).parent.parent
-                / "assets"
-                / "images"
-                / "target.png"
-            )
-            if not target_image_path.exists():
-                raise FileNotFoundError(f"Target image not found: {target_image_path}")
-            target_image = Image.open(target_image_path)
+            target_image = _default_target_image()
 
         width, height = target_image.size
 
@@ -222,15 +1326,31 @@ class GeminiImageAnalyzer:
         Returns:
             str: Geminiからの分析結果
         """
+        # フィンガープリントは全画素を読むため、イベントループを塞がないようワーカースレッドで計算する
+        fingerprint = await asyncio.to_thread(_image_fingerprint, image)
+        cache_key = "|".join(
+            [
+                self.model_name,
+                fingerprint,
+                hashlib.blake2b(prompt.encode("utf-8"), digest_size=16).hexdigest(),
+            ]
+        )
+        cached = self._analysis_cache.get(cache_key)
+        if cached is not None:
+            return cached
+
         try:
-            contents = self._build_contents(prompt, image)
-            response = self.client.models.generate_content(
-                model=self.model_name,
-                contents=contents,
-            )
-            return response.text
+            contents = self._build_contents_with_parts(prompt, *await self._encode_parts(image))
+            response = await self._generate(contents=contents)
+            # response.text は参照のたびにパートを連結し直すため一度だけ読む
+            text = response.text
+            if text:
+                self._analysis_cache.put(cache_key, text)
+            return text
         except Exception as e:
-            raise Exception(f"画像分析エラー: {str(e)}")
+            if _is_rate_limited(e):
+                raise
+            raise RuntimeError(f"画像分析エラー: {str(e)}") from e
 
     async def analyze_pdf_document(
         self,
@@ -253,142 +1373,99 @@ class GeminiImageAnalyzer:
         Returns:
             Dict[str, Any]: 構造化された検出結果
         """
-        # 出力スキーマ（Structured Output）
-        detection_schema: Dict[str, Any] = {
-            "type": "object",
-            "properties": {
-                "summary": {
-                    "type": "object",
-                    "properties": {
-                        "total_detections": {"type": "integer"},
-                        "pf100_count": {"type": "integer"},
-                        "pf150_fd_count": {"type": "integer"},
-                        "notes": {"type": "string"},
-                    },
-                    "required": ["total_detections", "pf100_count", "pf150_fd_count"],
-                },
-                "pages": {
-                    "type": "array",
-                    "items": {
-                        "type": "object",
-                        "properties": {
-                            "page": {"type": "integer"},
-                            "detections": {
-                                "type": "array",
-                                "items": {
-                                    "type": "object",
-                                    "properties": {
-                                        "target": {
-                                            "type": "string",
-                                            "enum": ["PF100", "PF150_FD"],
-                                        },
-                                        "position": {
-                                            "type": "object",
-                                            "properties": {
-                                                "x": {"type": "integer", "minimum": 0, "maximum": 1000},
-                                                "y": {"type": "integer", "minimum": 0, "maximum": 1000},
-                                            },
-                                            "required": ["x", "y"],
-                                        },
-                                        "bbox": {
-                                            "type": "array",
-                                            "items": {"type": "integer", "minimum": 0, "maximum": 1000},
-                                            "minItems": 4,
-                                            "maxItems": 4,
-                                            "description": "[x, y, width, height] normalized to [0,1000]",
-                                        },
-                                        "confidence": {"type": "number"},
-                                        "rationale": {"type": "string"},
-                                    },
-                                    "required": ["target", "position"],
-                                },
-                            },
-                        },
-                        "required": ["page", "detections"],
-                    },
-                },
-            },
-            "required": ["summary", "pages"],
-        }
-
-        base_prompt = (
-            "あなたは図面解析の専門アシスタントです。"
-            "次のPDFは建築図面です。各ページごとに以下を厳密に検出してください:\n"
-            "- 100mm径パイプシャフト（PF100）\n"
-            "- 防火ダンパー付き（FD付）の150mm径パイプシャフト（PF150）\n\n"
-            "出力要件:\n"
-            "- スキーマに沿ったJSONのみを返すこと（追加の説明文は返さない）\n"
-            "- 検出対象以外は含めない\n"
-            "- 座標は[0,1000]の範囲に正規化して返すこと。ページの左上を(0,0)、右下を(1000,1000)とする\n"
-            "- position.x, position.y は[0,1000]の整数で記録\n"
-            "- 矩形が分かる場合は bbox=[x,y,width,height] を[0,1000]の範囲で併記\n"
-            "- ページごとの件数と全体の件数をsummaryに集計\n"
-            "- 検出がなければ該当ページのdetectionsは空配列\n"
-            "- PF150( FD付 )は target='PF150_FD' として統一\n"
-        )
-
-        final_prompt = base_prompt if not prompt else (base_prompt + "\n補足指示:\n" + prompt)
+        base_prompt = _PDF_BASE_PROMPT
+        # 可変部分（補足指示）はPDFの後ろに置き、固定指示文+PDFを毎回同一の先頭部分にする
+        dynamic_prompt = ("補足指示:\n" + prompt) if prompt else None
+        final_prompt = base_prompt if not prompt else (base_prompt + "\n" + dynamic_prompt)
+
+        # 同じPDF・プロンプト・モデルの解析結果は解析結果キャッシュ（メモリ/ディスク）から返す
+        cache_key = None
+        if self._extraction_cache is not None:
+            cache_key = extraction_cache_key(
+                "analyze_pdf_document",
+                self.model_name,
+                _PDF_PROMPT_VERSION,
+                final_prompt,
+                pdf_bytes,
+            )
+            cached = await self._extraction_cache.aget(cache_key)
+            if cached is not None:
+                if "summary" in cached and "pages" in cached:
+                    if debug:
+                        cached["_debug"] = {"cache": "hit", "model": self.model_name}
+                    return cached
+                await self._extraction_cache.adelete(cache_key)
 
         try:
-            contents = [
-                types.Content(
-                    role="user",
-                    parts=[
-                        types.Part.from_text(text=final_prompt),
-                        types.Part.from_bytes(data=pdf_bytes, mime_type="application/pdf"),
-                    ],
-                )
+            parts = [
+                types.Part.from_text(text=base_prompt),
+                types.Part.from_bytes(data=pdf_bytes, mime_type="application/pdf"),
             ]
+            if dynamic_prompt:
+                parts.append(types.Part.from_text(text=dynamic_prompt))
+            contents = [types.Content(role="user", parts=parts)]
+
+            generation_config = _PDF_GEN_CONFIG
+
+            # 同じ大きなPDFの再解析では、PDF本体と固定指示文を明示的キャッシュから参照する
+            context_cache = None
+            if len(pdf_bytes) >= _CONTEXT_CACHE_MIN_PDF_BYTES:
+                pdf_id = "pdf:" + hashlib.sha256(pdf_bytes).hexdigest()
+                if self._context_cache_seen.get(pdf_id):
+                    context_cache = {
+                        "id": pdf_id,
+                        "system_instruction": base_prompt,
+                        "contents": [
+                            types.Content(
+                                role="user",
+                                parts=[
+                                    types.Part.from_bytes(
+                                        data=pdf_bytes, mime_type="application/pdf"
+                                    )
+                                ],
+                            )
+                        ],
+                        "request_contents": [
+                            types.Content(
+                                role="user",
+                                parts=[
+                                    types.Part.from_text(
+                                        text=dynamic_prompt
+                                        or "上記の指示に従ってPDFを解析してください。"
+                                    )
+                                ],
+                            )
+                        ],
+                    }
+                else:
+                    self._context_cache_seen.put(pdf_id, True)
 
-            generation_config = types.GenerateContentConfig(
-                response_mime_type="application/json",
-                response_schema=detection_schema,
+            # 一部環境でstructured output未対応な場合のフォールバック
+            fallback_prompt = (
+                f"{final_prompt}\n\n{_FALLBACK_JSON_INSTRUCTION}{_PDF_FALLBACK_EXAMPLE}"
             )
-
-            try:
-                response = self.client.models.generate_content(
-                    model=self.model_name,
-                    contents=contents,
-                    config=generation_config,
-                )
-            except Exception:
-                # 一部環境でstructured output未対応な場合のフォールバック
-                fallback_prompt = (
-                    final_prompt
-                    + "\n\n必ず次の形式のJSONのみを返してください: "
-                    + json.dumps(
-                        {
-                            "summary": {
-                                "total_detections": 0,
-                                "pf100_count": 0,
-                                "pf150_fd_count": 0,
-                            },
-                            "pages": [],
-                        }
+            response = await self._generate_structured(
+                contents,
+                generation_config,
+                lambda: [
+                    types.Content(
+                        role="user",
+                        parts=[
+                            types.Part.from_text(text=fallback_prompt),
+                            types.Part.from_bytes(data=pdf_bytes, mime_type="application/pdf"),
+                        ],
                     )
-                )
-                response = self.client.models.generate_content(
-                    model=self.model_name,
-                    contents=[
-                        types.Content(
-                            role="user",
-                            parts=[
-                                types.Part.from_text(text=fallback_prompt),
-                                types.Part.from_bytes(
-                                    data=pdf_bytes, mime_type="application/pdf"
-                                ),
-                            ],
-                        )
-                    ],
-                )
+                ],
+                context_cache=context_cache,
+            )
 
-            data = self._extract_structured(response)
             response_text = (getattr(response, "text", None) or "").strip()
+            data = self._extract_structured(response, response_text)
 
             if not isinstance(data, dict) or not data:
                 # テキストからのフォールバックJSONパース
                 try:
-                    data = json.loads(response_text) if response_text else None
+                    data = _json_loads(_strip_code_fence(response_text)) if response_text else None
                 except Exception:
                     data = None
 
@@ -410,13 +1487,20 @@ class GeminiImageAnalyzer:
                     }
                 return fb
 
+            if cache_key is not None:
+                await self._extraction_cache.aput(
+                    cache_key,
+                    data,
+                    metadata={"method": "analyze_pdf_document", "model": self.model_name},
+                )
+
             if debug:
                 data.setdefault("_debug", {})
                 try:
                     data["_debug"].update(
                         {
                             "prompt": final_prompt,
-                            "raw_response_text": response_text or json.dumps(data),
+                            "raw_response_text": response_text,
                             "model": self.model_name,
                         }
                     )
@@ -425,33 +1509,133 @@ class GeminiImageAnalyzer:
 
             return data
         except Exception as e:
-            raise Exception(f"PDF分析エラー: {str(e)}")
+            if _is_rate_limited(e):
+                raise
+            raise RuntimeError(f"PDF分析エラー: {str(e)}") from e
+
+    async def analyze_images(
+        self,
+        images: List[Image.Image],
+        prompt: str = "この画像の内容を詳しく説明してください。",
+    ) -> List[str]:
+        """
+        複数画像を分析する
+
+        複数ページは1回のリクエストにまとめて送信し、ページ番号付きのJSONで結果を受け取る。
+        画像トークンの見積りが上限を超える場合や、まとめた応答を解釈できなかった場合は
+        ページごとの個別リクエストで分析する。
+
+        Args:
+            images: PIL Imageオブジェクトのリスト
+            prompt: 分析用プロンプト
+
+        Returns:
+            List[str]: 各画像の分析結果のリスト
+        """
+        # 同一内容のページ（表紙・テンプレート等）は一度だけ送信し、結果を各ページへ配り直す
+        first_index: Dict[str, int] = {}
+        unique_pages: List[int] = []
+        slot_of_page: List[int] = []
+        fingerprints = await asyncio.to_thread(_image_fingerprints, images)
+        for i, fingerprint in enumerate(fingerprints):
+            if fingerprint not in first_index:
+                first_index[fingerprint] = len(unique_pages)
+                unique_pages.append(i)
+            slot_of_page.append(first_index[fingerprint])
+        unique_images = [images[i] for i in unique_pages]
+
+        # 一括送信は画像トークンの見積りが上限内の場合のみ（超える場合はページごとに送信）
+        results: Optional[List[str]] = None
+        if (
+            len(unique_images) > 1
+            and sum(self._estimate_upload_tokens(img) for img in unique_images)
+            <= _BATCH_IMAGE_TOKEN_BUDGET
+        ):
+            results = await self.analyze_images_batched(unique_images, prompt)
+        if results is None:
+            results = await self._analyze_images_per_page(
+                unique_images, prompt, page_numbers=[i + 1 for i in unique_pages]
+            )
+        return [results[slot] for slot in slot_of_page]
+
+    def _estimate_upload_tokens(self, image: Image.Image) -> int:
+        """Token estimate for the image as _pil_to_part would send it (after downscale)."""
+        width, height = image.size
+        if self.max_image_dim and max(width, height) > self.max_image_dim:
+            scale = self.max_image_dim / max(width, height)
+            width, height = max(1, int(width * scale)), max(1, int(height * scale))
+        return _estimate_image_tokens(width, height)
+
+    async def analyze_images_batched(
+        self, images: List[Image.Image], prompt: str
+    ) -> Optional[List[str]]:
+        """
+        複数画像を1回のリクエストでまとめて分析する
+
+        共通のプロンプトは1回分のみ送信し、ページ番号付きのJSONで各画像の結果を受け取る。
+
+        Args:
+            images: PIL Imageオブジェクトのリスト（1枚目がページ1）
+            prompt: 分析用プロンプト
+
+        Returns:
+            Optional[List[str]]: 各画像の分析結果のリスト（応答を解釈できない場合はNone）
+        """
+        batch_prompt = (
+            f"{prompt}\n\n"
+            f"以下に{len(images)}枚の画像を順番に添付します（1枚目がページ1）。"
+            "各ページを個別に分析し、ページ番号ごとの結果をスキーマに沿ったJSONのみで返してください。"
+        )
+        try:
+            response = await self._generate(
+                contents=self._build_contents_with_parts(
+                    batch_prompt, *await self._encode_parts(*images)
+                ),
+                config=_IMAGES_BATCH_GEN_CONFIG,
+            )
+        except Exception:
+            logging.getLogger("pdf_highlight_api.gemini").warning(
+                "Batched image analysis failed; falling back to per-page requests",
+                exc_info=True,
+            )
+            return None
+
+        data = self._extract_structured(response)
+        pages = data.get("pages") if isinstance(data, dict) else None
+        if not isinstance(pages, list):
+            return None
+        by_page = {p.get("page"): p.get("result") for p in pages if isinstance(p, dict)}
+        results = [by_page.get(i + 1) for i in range(len(images))]
+        if not all(isinstance(r, str) for r in results):
+            return None
+        return results
 
-    async def analyze_images(
+    async def _analyze_images_per_page(
         self,
         images: List[Image.Image],
-        prompt: str = "この画像の内容を詳しく説明してください。",
+        prompt: str,
+        page_numbers: Optional[List[int]] = None,
     ) -> List[str]:
-        """
-        複数画像を分析する
-
-        Args:
-            images: PIL Imageオブジェクトのリスト
-            prompt: 分析用プロンプト
+        """Analyze pages with one request each, bounded by max_concurrency.
 
-        Returns:
-            List[str]: 各画像の分析結果のリスト
+        page_numbers gives the original page label for each image when the
+        list has been deduplicated; it defaults to 1..len(images).
         """
-        results = []
-        for i, image in enumerate(images):
-            try:
-                page_prompt = f"{prompt} (ページ {i+1})"
-                result = await self.analyze_image(image, page_prompt)
-                results.append(result)
-            except Exception as e:
-                results.append(f"ページ {i+1} の分析エラー: {str(e)}")
+        sem = asyncio.Semaphore(self.max_concurrency)
+        if page_numbers is None:
+            page_numbers = list(range(1, len(images) + 1))
 
-        return results
+        async def _one(page: int, image: Image.Image) -> str:
+            async with sem:
+                try:
+                    page_prompt = f"{prompt} (ページ {page})"
+                    return await self.analyze_image(image, page_prompt)
+                except Exception as e:
+                    return f"ページ {page} の分析エラー: {str(e)}"
+
+        return list(
+            await asyncio.gather(*(_one(p, img) for p, img in zip(page_numbers, images)))
+        )
 
     async def analyze_symbol_with_coordinates(
         self,
@@ -475,132 +1659,51 @@ class GeminiImageAnalyzer:
         if custom_target_image:
             target_image = custom_target_image
         else:
-            # デフォルトのtarget.png画像を読み込む
-            import pathlib
-
-            target_image_path = (
-                pathlib.Path(__file__).parent.parent
-                / "assets"
-                / "images"
-                / "target.png"
-            )
-
-            if not target_image_path.exists():
-                raise FileNotFoundError(f"Target image not found: {target_image_path}")
-
-            target_image = Image.open(target_image_path)
+            # デフォルトのtarget.png画像（プロセス内で一度だけデコード）
+            target_image = _default_target_image()
 
         # 画像サイズを取得
         img_w, img_h = image.size
 
-        # ターゲット説明（任意）
-        target_note = (
-            f"\n参考となるターゲットの特徴:\n{target_description}\n"
-            if target_description
-            else ""
-        )
-
-        coordinate_prompt = (
-            "あなたは図面上の記号検出器です。"
-            "赤枠があれば枠内のみを解析し、参照画像（target.png）と同一形状の記号のみ検出。"
-            "回転・スケール差やノイズに頑健に一致させ、誤検出は避ける。"
-            "座標は必ず[0,1000]の範囲に正規化して返すこと。"
-            "画像の左上を(0,0)、右下を(1000,1000)とする正規化座標系を使用。"
-            "各検出は 'symbol_bbox': [x, y, width, height] を[0,1000]の範囲で返してください。"
-            "補助として 'box_2d': [ymin, xmin, ymax, xmax] も[0,1000]の範囲で含めてもよい。"
-            "値は必ず0以上1000以下の整数で返すこと。"
-            f"{target_note}"
-        )
+        coordinate_prompt = _symbol_detection_prompt(target_description)
 
-        detection_schema: Dict[str, Any] = {
-            "type": "object",
-            "properties": {
-                "image_size": {
-                    "type": "object",
-                    "properties": {
-                        "width": {"type": "integer"},
-                        "height": {"type": "integer"},
-                        "unit": {"type": "string", "enum": ["px"]},
-                    },
-                    "required": ["width", "height", "unit"],
-                },
-                "coordinate_space": {"type": "string", "enum": ["pixel"]},
-                "detections": {
-                    "type": "array",
-                    "items": {
-                        "type": "object",
-                        "properties": {
-                            "symbol_type": {"type": "string"},
-                            "symbol_bbox": {
-                                "type": "array",
-                                "items": {"type": "number", "minimum": 0, "maximum": 1000},
-                                "minItems": 4,
-                                "maxItems": 4,
-                                "description": "[x, y, width, height] normalized to [0,1000]"
-                            },
-                            "box_2d": {
-                                "type": "array",
-                                "items": {"type": "number", "minimum": 0, "maximum": 1000},
-                                "minItems": 4,
-                                "maxItems": 4,
-                                "description": "[ymin, xmin, ymax, xmax] normalized to [0,1000]"
-                            },
-                            "confidence": {"type": "number"},
-                            "rationale": {"type": "string"},
-                            "matched_features": {
-                                "type": "array",
-                                "items": {"type": "string"},
-                            },
-                        },
-                        "required": ["confidence"],
-                    },
-                },
-                "summary": {
-                    "type": "object",
-                    "properties": {
-                        "total_detections": {"type": "integer"},
-                        "notes": {"type": "string"},
-                    },
-                    "required": ["total_detections"],
-                },
-            },
-            "required": ["detections", "summary"],
-        }
+        # 同じ図面・ターゲット・プロンプト・モデルの解析結果は解析結果キャッシュ（メモリ/ディスク）から返す
+        cache_key = None
+        if self._extraction_cache is not None:
+            image_fingerprint, target_fingerprint = await asyncio.to_thread(
+                _image_fingerprints, [image, target_image]
+            )
+            cache_key = self._symbol_cache_key(
+                coordinate_prompt, image_fingerprint, target_fingerprint
+            )
+            cached = await self._extraction_cache.aget(cache_key)
+            if cached is not None:
+                if "detections" in cached and "summary" in cached:
+                    if debug:
+                        cached["_debug"] = {"cache": "hit", "model": self.model_name}
+                    return cached
+                await self._extraction_cache.adelete(cache_key)
 
         try:
-            # 構造化出力を有効化
-            generation_config = types.GenerateContentConfig(
-                response_mime_type="application/json",
-                response_schema=detection_schema,
+            # 構造化出力を有効化（設定はモジュール定数を共有）
+            generation_config = _SYMBOL_GEN_CONFIG
+            # 図面・ターゲット画像はワーカースレッドで並行して一度だけエンコードし、フォールバックでも再利用する
+            image_parts = await asyncio.gather(
+                asyncio.to_thread(self._pil_to_part, image),
+                asyncio.to_thread(self._target_part, target_image),
+            )
+            # 一部SDK/モデルでstructured outputが未対応な場合のフォールバック
+            fallback_prompt = (
+                f"{coordinate_prompt}{_FALLBACK_JSON_INSTRUCTION}{_DETECTIONS_FALLBACK_EXAMPLE}"
+            )
+            response = await self._generate_structured(
+                self._build_contents_with_parts(coordinate_prompt, *image_parts),
+                generation_config,
+                lambda: self._build_contents_with_parts(fallback_prompt, *image_parts),
             )
-            try:
-                response = self.client.models.generate_content(
-                    model=self.model_name,
-                    contents=self._build_contents(coordinate_prompt, image, target_image),
-                    config=generation_config,
-                )
-            except Exception as e:
-                # 一部SDK/モデルでstructured outputが未対応な場合のフォールバック
-                fallback_prompt = (
-                    coordinate_prompt
-                    + "必ず次の形式のJSONのみを返してください: "
-                    + json.dumps(
-                        {
-                            "detections": [
-                                {"symbol_bbox": [0, 0, 0, 0], "confidence": 0.0}
-                            ],
-                            "summary": {"total_detections": 0},
-                        }
-                    )
-                )
-                response = self.client.models.generate_content(
-                    model=self.model_name,
-                    contents=self._build_contents(fallback_prompt, image, target_image),
-                )
             # Structured output: prefer response.parsed (SDK >=0.7)
-            detection_data = None
-            detection_data = self._extract_structured(response)
             response_text = (getattr(response, "text", None) or "").strip()
+            detection_data = self._extract_structured(response, response_text)
 
             try:
                 if detection_data is None:
@@ -620,13 +1723,22 @@ class GeminiImageAnalyzer:
 
                 # Ensure coordinate_space is set
                 detection_data["coordinate_space"] = "normalized_1000"
+                if cache_key is not None and "detections" in detection_data:
+                    await self._extraction_cache.aput(
+                        cache_key,
+                        detection_data,
+                        metadata={
+                            "method": "analyze_symbol_with_coordinates",
+                            "model": self.model_name,
+                        },
+                    )
                 
                 if debug:
                     detection_data.setdefault("_debug", {})
                     detection_data["_debug"].update(
                         {
                             "prompt": coordinate_prompt,
-                            "raw_response_text": response_text or json.dumps(detection_data),
+                            "raw_response_text": response_text,
                             "model": self.model_name,
                             "coordinate_space": "normalized_1000",
                         }
@@ -654,7 +1766,7 @@ class GeminiImageAnalyzer:
                 if debug:
                     fb["_debug"] = {
                         "prompt": coordinate_prompt,
-                        "raw_response_text": (getattr(response, "text", None) or ""),
+                        "raw_response_text": response_text,
                         "model": self.model_name,
                     }
                 return fb
@@ -669,6 +1781,161 @@ class GeminiImageAnalyzer:
                 fb["_debug"] = {"model": self.model_name}
             return fb
 
+    def _symbol_cache_key(
+        self,
+        coordinate_prompt: str,
+        image_fingerprint: str,
+        target_fingerprint: str,
+        method: str = "analyze_symbol_with_coordinates",
+    ) -> str:
+        """Extraction-cache key for one page of symbol detection.
+
+        Batched results are stored under their own method name, so a single
+        page request never receives a result produced by the batch prompt.
+        """
+        return extraction_cache_key(
+            method,
+            self.model_name,
+            _SYMBOL_PROMPT_VERSION,
+            coordinate_prompt,
+            image_fingerprint,
+            target_fingerprint,
+        )
+
+    async def analyze_symbols_batch(
+        self,
+        images: List[Image.Image],
+        custom_target_image: Image.Image = None,
+        *,
+        debug: bool = False,
+        target_description: Optional[str] = None,
+    ) -> List[Optional[Dict[str, Any]]]:
+        """
+        複数ページの記号検出を1回のリクエストにまとめて行う
+
+        指示文とターゲット画像は1回分のみ送信し、ページ番号付きのJSONで各ページの検出結果を受け取る。
+        キャッシュ済みのページは送信しない。画像トークンの見積りが上限を超える場合やリクエストに失敗した場合、
+        応答にそのページの結果が無い場合は該当ページをNoneとして返す（呼び出し側でページごとに検出する）。
+
+        Args:
+            images: ページ順のPIL Imageオブジェクトのリスト（1枚目がページ1）
+            custom_target_image: カスタムターゲット画像（オプション）
+            target_description: ターゲットの特徴説明（プロンプト末尾に付加）
+
+        Returns:
+            List[Optional[Dict[str, Any]]]: ページ順の検出結果（analyze_symbol_with_coordinates と同じ形式）
+        """
+        target_image = custom_target_image or _default_target_image()
+        coordinate_prompt = _symbol_detection_prompt(target_description)
+
+        results: List[Optional[Dict[str, Any]]] = [None] * len(images)
+        cache_keys: List[Optional[str]] = [None] * len(images)
+        if self._extraction_cache is not None:
+            # 全ページとターゲット画像のフィンガープリントはワーカースレッドでまとめて計算する
+            *page_fingerprints, target_fingerprint = await asyncio.to_thread(
+                _image_fingerprints, [*images, target_image]
+            )
+            for i, image_fingerprint in enumerate(page_fingerprints):
+                cache_keys[i] = self._symbol_cache_key(
+                    coordinate_prompt,
+                    image_fingerprint,
+                    target_fingerprint,
+                    method="analyze_symbols_batch",
+                )
+                cached = await self._extraction_cache.aget(cache_keys[i])
+                if cached is not None and "detections" in cached and "summary" in cached:
+                    if debug:
+                        cached["_debug"] = {"cache": "hit", "model": self.model_name}
+                    results[i] = cached
+
+        pending = [i for i, result in enumerate(results) if result is None]
+        if not pending:
+            return results
+        log = logging.getLogger("pdf_highlight_api.gemini")
+        if (
+            sum(self._estimate_upload_tokens(images[i]) for i in pending)
+            > _BATCH_IMAGE_TOKEN_BUDGET
+        ):
+            log.info("Symbol batch over image token budget; detecting %d pages one by one", len(pending))
+            return results
+
+        # キャッシュ済みのページを除くとページ番号は連続しないため、使う番号を明示する
+        page_labels = [i + 1 for i in pending]
+        batch_prompt = (
+            f"{coordinate_prompt}\n"
+            f"以下、参照画像（target.png）の後に{len(pending)}ページ分の図面画像を"
+            "「ページN」の見出しに続けて添付します。"
+            "各ページを個別に解析し、ページ番号ごとの結果をスキーマに沿ったJSONのみで返してください。"
+            f"pageには見出しの番号（{', '.join(map(str, page_labels))}）をそのまま使い、番号を振り直さないこと。"
+        )
+        fallback_prompt = (
+            f"{batch_prompt}\n{_FALLBACK_JSON_INSTRUCTION}{_SYMBOL_BATCH_FALLBACK_EXAMPLE}"
+        )
+        try:
+            target_part, page_parts = await asyncio.gather(
+                asyncio.to_thread(self._target_part, target_image),
+                self._encode_parts(*(images[i] for i in pending)),
+            )
+            labelled_parts: List[types.Part] = [target_part]
+            for i, part in zip(pending, page_parts):
+                labelled_parts.append(types.Part.from_text(text=f"ページ{i + 1}"))
+                labelled_parts.append(part)
+            response = await self._generate_structured(
+                self._build_contents_with_parts(batch_prompt, *labelled_parts),
+                _SYMBOL_BATCH_GEN_CONFIG,
+                lambda: self._build_contents_with_parts(fallback_prompt, *labelled_parts),
+            )
+        except Exception:
+            log.warning(
+                "Batched symbol detection failed; falling back to per-page requests",
+                exc_info=True,
+            )
+            return results
+
+        response_text = (getattr(response, "text", None) or "").strip()
+        data = _validate_symbol_batch(self._extract_structured(response, response_text))
+        returned = [p["page"] for p in data["pages"]] if data is not None else []
+        # 見出しに無い番号や重複があれば振り直された可能性があり、ページとの対応を信用できない
+        if (
+            data is None
+            or len(set(returned)) != len(returned)
+            or not set(returned) <= set(page_labels)
+        ):
+            log.warning(
+                "Batched symbol detection returned unusable pages %s (expected %s); "
+                "falling back to per-page requests",
+                returned,
+                page_labels,
+            )
+            return results
+        by_page = {p["page"]: p["detections"] for p in data["pages"]}
+
+        for i in pending:
+            detections = by_page.get(i + 1)
+            if detections is None:
+                continue
+            detection_data: Dict[str, Any] = {
+                "detections": detections,
+                "summary": {"total_detections": len(detections)},
+                "coordinate_space": "normalized_1000",
+            }
+            if cache_keys[i] is not None:
+                await self._extraction_cache.aput(
+                    cache_keys[i],
+                    detection_data,
+                    metadata={"method": "analyze_symbols_batch", "model": self.model_name},
+                )
+            if debug:
+                detection_data["_debug"] = {
+                    "prompt": batch_prompt,
+                    "raw_response_text": response_text,
+                    "model": self.model_name,
+                    "coordinate_space": "normalized_1000",
+                    "batched_pages": len(pending),
+                }
+            results[i] = detection_data
+        return results
+
     async def analyze_image_with_coordinates(
         self,
         image: Image.Image,
@@ -687,82 +1954,42 @@ class GeminiImageAnalyzer:
         Returns:
             dict: 検出結果と座標情報
         """
-        # target.png画像を読み込む
-        import pathlib
-
-        target_image_path = (
-            pathlib.Path(__file__).parent.parent / "assets" / "images" / "target.png"
+        fingerprint = await asyncio.to_thread(_image_fingerprint, image)
+        cache_key = "|".join(
+            [
+                self.model_name,
+                _COORDINATE_PROMPT_VERSION,
+                fingerprint,
+                ",".join(target_texts),
+            ]
         )
+        cached = self._coordinate_cache.get(cache_key)
+        if cached is not None:
+            return cached
 
-        if not target_image_path.exists():
-            raise FileNotFoundError(f"Target image not found: {target_image_path}")
+        # target.png画像（プロセス内で一度だけデコード）
+        target_image = _default_target_image()
 
-        target_image = Image.open(target_image_path)
-
-        coordinate_prompt = (
-            "画像内（赤枠があれば枠内）の図面から、参照画像（target.png）と同一形状の記号のみを検出。"
-            "回転やスケール差に頑健に対応し、誤検出を避ける。"
-        )
+        coordinate_prompt = _COORDINATE_PROMPT
 
         try:
-            generation_config = types.GenerateContentConfig(
-                response_mime_type="application/json",
-                response_schema={
-                    "type": "object",
-                    "properties": {
-                        "detections": {
-                            "type": "array",
-                            "items": {
-                                "type": "object",
-                                "properties": {
-                                    "text": {"type": "string"},
-                                    "symbol_bbox": {
-                                        "type": "array",
-                                        "items": {"type": "number"}
-                                    },
-                                    "box_2d": {
-                                        "type": "array",
-                                        "items": {"type": "number"}
-                                    },
-                                    "confidence": {"type": "number"},
-                                    "rationale": {"type": "string"},
-                                    "matched_features": {
-                                        "type": "array",
-                                        "items": {"type": "string"},
-                                    },
-                                },
-                                "required": ["confidence"],
-                            },
-                        },
-                        "summary": {
-                            "type": "object",
-                            "properties": {
-                                "total_detections": {"type": "integer"}
-                            },
-                            "required": ["total_detections"],
-                        },
-                    },
-                    "required": ["detections", "summary"],
-                },
+            generation_config = _COORDINATE_GEN_CONFIG
+            # 図面・ターゲット画像はワーカースレッドで並行して一度だけエンコードし、フォールバックでも再利用する
+            image_parts = await asyncio.gather(
+                asyncio.to_thread(self._pil_to_part, image),
+                asyncio.to_thread(self._target_part, target_image),
+            )
+            fallback_prompt = (
+                f"{coordinate_prompt}{_FALLBACK_JSON_INSTRUCTION}{_DETECTIONS_FALLBACK_EXAMPLE}"
+            )
+            response = await self._generate_structured(
+                self._build_contents_with_parts(coordinate_prompt, *image_parts),
+                generation_config,
+                lambda: self._build_contents_with_parts(fallback_prompt, *image_parts),
             )
-            try:
-                response = self.client.models.generate_content(
-                    model=self.model_name,
-                    contents=self._build_contents(coordinate_prompt, image, target_image),
-                    config=generation_config,
-                )
-            except Exception:
-                fallback_prompt = (
-                    coordinate_prompt
-                    + "必ず次の形式のJSONのみを返してください: {\"detections\":[], \"summary\":{\"total_detections\":0}}"
-                )
-                response = self.client.models.generate_content(
-                    model=self.model_name,
-                    contents=self._build_contents(fallback_prompt, image, target_image),
-                )
             # Prefer structured parsed output
-            detection_data = self._extract_structured(response)
             response_text = (getattr(response, "text", None) or "").strip()
+            detection_data = self._extract_structured(response, response_text)
             # 検出結果が空の場合は、より柔軟なプロンプトでリトライ
             if (
                 not detection_data
@@ -770,6 +1997,8 @@ class GeminiImageAnalyzer:
                 or detection_data.get("summary", {}).get("total_detections", 0) == 0
             ):
                 fb = await self._retry_with_flexible_prompt(image, target_texts)
+                if not fb.get("fallback") and fb.get("detections"):
+                    self._coordinate_cache.put(cache_key, fb)
                 if debug:
                     fb.setdefault("_debug", {})
                     fb["_debug"]["prompt"] = coordinate_prompt
@@ -777,17 +2006,17 @@ class GeminiImageAnalyzer:
                     fb["_debug"]["model"] = self.model_name
                 return fb
 
-                # Keep coordinates as [0,1000] normalized - do not convert to pixels
-                # The detection data already contains normalized coordinates
-                detection_data["coordinate_space"] = "normalized_1000"
+            # Keep coordinates as [0,1000] normalized - do not convert to pixels
+            # The detection data already contains normalized coordinates
+            detection_data["coordinate_space"] = "normalized_1000"
+            self._coordinate_cache.put(cache_key, detection_data)
 
-                if debug:
-                    detection_data.setdefault("_debug", {})
-                    detection_data["_debug"]["prompt"] = coordinate_prompt
-                    detection_data["_debug"]["raw_response_text"] = response_text or json.dumps(detection_data)
-                    detection_data["_debug"]["model"] = self.model_name
-                    detection_data["_debug"]["bbox_samples"] = debug_samples
-                return detection_data
+            if debug:
+                detection_data.setdefault("_debug", {})
+                detection_data["_debug"]["prompt"] = coordinate_prompt
+                detection_data["_debug"]["raw_response_text"] = response_text
+                detection_data["_debug"]["model"] = self.model_name
+            return detection_data
 
         except Exception as e:
             return {
@@ -802,70 +2031,26 @@ class GeminiImageAnalyzer:
         """
         より柔軟なプロンプトでのリトライ検出
         """
-        # target.png画像を再度読み込む
-        import pathlib
-
-        target_image_path = (
-            pathlib.Path(__file__).parent.parent / "assets" / "images" / "target.png"
-        )
-        target_image = Image.open(target_image_path)
+        # target.png画像（デコード済みのものを再利用）
+        target_image = _default_target_image()
 
-        flexible_prompt = (
-            "赤枠内の図面から、参照画像（target.png）に似た円形で中に十字の記号を検出。"
-            "回転・スケール差に頑健。誤検出を避ける。"
-        )
+        flexible_prompt = _FLEXIBLE_PROMPT
 
         try:
-            generation_config = types.GenerateContentConfig(
-                response_mime_type="application/json",
-                response_schema={
-                    "type": "object",
-                    "properties": {
-                        "detections": {
-                            "type": "array",
-                            "items": {
-                                "type": "object",
-                                "properties": {
-                                    "text": {"type": "string"},
-                                    "symbol_bbox": {
-                                        "type": "array",
-                                        "items": {"type": "number"}
-                                    },
-                                    "box_2d": {
-                                        "type": "array",
-                                        "items": {"type": "number"}
-                                    },
-                                    "confidence": {"type": "number"},
-                                },
-                                "required": ["confidence"],
-                            },
-                        },
-                        "summary": {
-                            "type": "object",
-                            "properties": {
-                                "total_detections": {"type": "integer"}
-                            },
-                            "required": ["total_detections"],
-                        },
-                    },
-                    "required": ["detections", "summary"],
-                },
+            generation_config = _FLEXIBLE_GEN_CONFIG
+            # 図面・ターゲット画像はワーカースレッドで並行して一度だけエンコードし、フォールバックでも再利用する
+            image_parts = await asyncio.gather(
+                asyncio.to_thread(self._pil_to_part, image),
+                asyncio.to_thread(self._target_part, target_image),
             )
-            try:
-                response = self.client.models.generate_content(
-                    model=self.model_name,
-                    contents=self._build_contents(flexible_prompt, image, target_image),
-                    config=generation_config,
-                )
-            except Exception:
-                response = self.client.models.generate_content(
-                    model=self.model_name,
-                    contents=self._build_contents(flexible_prompt, image, target_image),
-                )
-            detection_data = self._extract_structured(response)
+            contents = self._build_contents_with_parts(flexible_prompt, *image_parts)
+            response = await self._generate_structured(
+                contents, generation_config, lambda: contents
+            )
+            response_text = getattr(response, "text", None) or ""
+            detection_data = self._extract_structured(response, response_text)
             if detection_data is not None:
                 return detection_data
-            response_text = (getattr(response, "text", None) or "")
             # 最後の手段として改良されたフォールバック分析
             return self._enhanced_fallback_analysis(response_text, target_texts, image)
 
@@ -886,58 +2071,53 @@ class GeminiImageAnalyzer:
         # 画像サイズ情報を取得
         width, height = image.size
 
-        # レスポンステキストから数値情報を推測
-        import re
+        # 大文字小文字を無視した照合のため、レスポンスは一度だけ小文字化する
+        response_lower = response_text.lower()
 
+        # レスポンステキストから数値情報を推測
         for text in target_texts:
-            # テキスト内でのキーワード出現回数をカウント（大文字小文字を無視）
-            pattern = re.compile(re.escape(text.replace("φ", "[φΦ]")), re.IGNORECASE)
-            matches = pattern.findall(response_text)
-            count = len(matches)
+            # テキスト内でのキーワード出現回数をカウント（リテラル照合なので正規表現は不要）
+            count = response_lower.count(text.lower())
 
             # より柔軟なパターンマッチング
             if count == 0:
                 # PF100, PF150 などの数字部分でも検索
-                number_pattern = re.search(r"PF(\d+)", text, re.IGNORECASE)
+                number_pattern = _PF_NUMBER_RE.search(text)
                 if number_pattern:
-                    number = number_pattern.group(1)
-                    flexible_pattern = f"PF{number}"
-                    flexible_matches = re.findall(
-                        flexible_pattern, response_text, re.IGNORECASE
-                    )
-                    count = len(flexible_matches)
+                    count = response_lower.count(f"pf{number_pattern.group(1)}")
 
             # キーワードごとのカウントを記録（動的）
-            keyword_key = (
-                f"{text.lower().replace('φ', 'phi').replace('Φ', 'phi')}_count"
-            )
+            keyword_key = f"{text.lower().translate(_PHI_TRANS)}_count"
             summary[keyword_key] = count
             summary["total_detections"] += count
 
-            # 画像サイズに基づいた推測座標を生成
-            for i in range(count):
-                # 画像を格子状に分割して配置
-                cols = max(1, int((count**0.5)))
-                rows = max(1, (count + cols - 1) // cols)
-
-                col = i % cols
-                row = i // cols
-
-                x = int(width * (col + 0.5) / cols - 50)  # 中心から50px左
-                y = int(height * (row + 0.5) / rows - 15)  # 中心から15px上
-
-                # 座標を有効な範囲に制限
-                x = max(0, min(x, width - 100))
-                y = max(0, min(y, height - 30))
+            if count == 0:
+                continue
 
-                detections.append(
-                    {
-                        "text": text,
-                        "bbox": [x, y, 100, 30],
-                        "confidence": 0.3,  # フォールバック検出は信頼度を低く設定
-                        "fallback": True,
-                    }
-                )
+            # 画像サイズに基づいた推測座標を生成（画像を格子状に分割して配置）
+            # 格子の列数・行数・セル幅はキーワードごとに一定なのでループ外で計算
+            cols = max(1, math.isqrt(count))
+            rows = max(1, (count + cols - 1) // cols)
+            cell_w = width / cols
+            cell_h = height / rows
+            max_x = width - 100
+            max_y = height - 30
+
+            detections.extend(
+                {
+                    "text": text,
+                    "bbox": [
+                        # 中心から50px左・15px上、有効な範囲に制限
+                        max(0, min(int(cell_w * (i % cols + 0.5) - 50), max_x)),
+                        max(0, min(int(cell_h * (i // cols + 0.5) - 15), max_y)),
+                        100,
+                        30,
+                    ],
+                    "confidence": 0.3,  # フォールバック検出は信頼度を低く設定
+                    "fallback": True,
+                }
+                for i in range(count)
+            )
 
         return {
             "detections": detections,
@@ -955,12 +2135,13 @@ class GeminiImageAnalyzer:
         detections = []
         summary = {"total_detections": 0}
 
+        # レスポンスの大文字化はキーワードごとではなく一度だけ行う
+        response_upper = response_text.upper()
+
         for text in target_texts:
-            count = response_text.upper().count(text.upper())
+            count = response_upper.count(text.upper())
             # キーワードごとのカウントを記録（動的）
-            keyword_key = (
-                f"{text.lower().replace('φ', 'phi').replace('Φ', 'phi')}_count"
-            )
+            keyword_key = f"{text.lower().translate(_PHI_TRANS)}_count"
             summary[keyword_key] = count
             summary["total_detections"] += count
 
@@ -993,62 +2174,6 @@ class GeminiImageAnalyzer:
         Returns:
             Dict[str, Any]: 構造化された検出結果
         """
-        # 出力スキーマ（パイプシャフト検出用）
-        detection_schema: Dict[str, Any] = {
-            "type": "object",
-            "properties": {
-                "summary": {
-                    "type": "object",
-                    "properties": {
-                        "total_detections": {"type": "integer"},
-                        "notes": {"type": "string"},
-                    },
-                    "required": ["total_detections"],
-                },
-                "pages": {
-                    "type": "array",
-                    "items": {
-                        "type": "object",
-                        "properties": {
-                            "page": {"type": "integer"},
-                            "detections": {
-                                "type": "array",
-                                "items": {
-                                    "type": "object",
-                                    "properties": {
-                                        "type": {
-                                            "type": "string",
-                                            "description": "パイプシャフトの種類（PF100, PF150など）",
-                                        },
-                                        "position": {
-                                            "type": "object",
-                                            "properties": {
-                                                "x": {"type": "integer", "minimum": 0, "maximum": 1000},
-                                                "y": {"type": "integer", "minimum": 0, "maximum": 1000},
-                                            },
-                                            "required": ["x", "y"],
-                                        },
-                                        "bbox": {
-                                            "type": "array",
-                                            "items": {"type": "integer", "minimum": 0, "maximum": 1000},
-                                            "minItems": 4,
-                                            "maxItems": 4,
-                                            "description": "[x, y, width, height] normalized to [0,1000]",
-                                        },
-                                        "confidence": {"type": "number"},
-                                        "description": {"type": "string"},
-                                    },
-                                    "required": ["position"],
-                                },
-                            },
-                        },
-                        "required": ["page", "detections"],
-                    },
-                },
-            },
-            "required": ["summary", "pages"],
-        }
-
         prompt = (
             "あなたは建築図面解析の専門アシスタントです。"
             "このPDFは図面を表しています。各ページから以下を検出してください:\n"
@@ -1066,6 +2191,24 @@ class GeminiImageAnalyzer:
             "- スキーマに沿ったJSONのみを返すこと（追加の説明文は返さない）\n"
         )
 
+        # 同じPDF・プロンプト・モデルの検出結果は解析結果キャッシュ（メモリ/ディスク）から返す
+        cache_key = None
+        if self._extraction_cache is not None:
+            cache_key = extraction_cache_key(
+                "analyze_pipe_shafts",
+                self.model_name,
+                _PIPE_SHAFT_PROMPT_VERSION,
+                prompt,
+                pdf_bytes,
+            )
+            cached = await self._extraction_cache.aget(cache_key)
+            if cached is not None:
+                if "summary" in cached and "pages" in cached:
+                    if debug:
+                        cached["_debug"] = {"cache": "hit", "model": self.model_name}
+                    return cached
+                await self._extraction_cache.adelete(cache_key)
+
         try:
             contents = [
                 types.Content(
@@ -1077,57 +2220,39 @@ class GeminiImageAnalyzer:
                 )
             ]
 
-            generation_config = types.GenerateContentConfig(
-                response_mime_type="application/json",
-                response_schema=detection_schema,
-            )
+            generation_config = _PIPE_SHAFT_GEN_CONFIG
 
-            try:
-                response = self.client.models.generate_content(
-                    model=self.model_name,
-                    contents=contents,
-                    config=generation_config,
-                )
-            except Exception:
-                # 一部環境でstructured output未対応な場合のフォールバック
-                fallback_prompt = (
-                    prompt
-                    + "\n\n必ず次の形式のJSONのみを返してください: "
-                    + json.dumps(
-                        {
-                            "summary": {
-                                "total_detections": 0,
-                            },
-                            "pages": [],
-                        }
+            # 一部環境でstructured output未対応な場合のフォールバック
+            fallback_prompt = (
+                f"{prompt}\n\n{_FALLBACK_JSON_INSTRUCTION}{_PAGES_FALLBACK_EXAMPLE}"
+            )
+            response = await self._generate_structured(
+                contents,
+                generation_config,
+                lambda: [
+                    types.Content(
+                        role="user",
+                        parts=[
+                            types.Part.from_text(text=fallback_prompt),
+                            types.Part.from_bytes(data=pdf_bytes, mime_type="application/pdf"),
+                        ],
                     )
-                )
-                response = self.client.models.generate_content(
-                    model=self.model_name,
-                    contents=[
-                        types.Content(
-                            role="user",
-                            parts=[
-                                types.Part.from_text(text=fallback_prompt),
-                                types.Part.from_bytes(
-                                    data=pdf_bytes, mime_type="application/pdf"
-                                ),
-                            ],
-                        )
-                    ],
-                )
+                ],
+            )
 
-            data = self._extract_structured(response)
             response_text = (getattr(response, "text", None) or "").strip()
+            data = self._extract_structured(response, response_text)
 
             if not isinstance(data, dict) or not data:
                 # テキストからのフォールバックJSONパース
                 try:
-                    data = json.loads(response_text) if response_text else None
+                    data = _json_loads(_strip_code_fence(response_text)) if response_text else None
                 except Exception:
                     data = None
 
-            if not isinstance(data, dict) or "summary" not in data or "pages" not in data:
+            # 型・必須項目を検証し、座標は[0,1000]の整数に正規化する
+            data = _validate_pages_result(data)
+            if data is None:
                 fb: Dict[str, Any] = {
                     "summary": {
                         "total_detections": 0,
@@ -1143,13 +2268,20 @@ class GeminiImageAnalyzer:
                     }
                 return fb
 
+            if cache_key is not None:
+                await self._extraction_cache.aput(
+                    cache_key,
+                    data,
+                    metadata={"method": "analyze_pipe_shafts", "model": self.model_name},
+                )
+
             if debug:
                 data.setdefault("_debug", {})
                 try:
                     data["_debug"].update(
                         {
                             "prompt": prompt,
-                            "raw_response_text": response_text or json.dumps(data),
+                            "raw_response_text": response_text,
                             "model": self.model_name,
                         }
                     )
@@ -1158,7 +2290,9 @@ class GeminiImageAnalyzer:
 
             return data
         except Exception as e:
-            raise Exception(f"パイプシャフト検出エラー: {str(e)}")
+            if _is_rate_limited(e):
+                raise
+            raise RuntimeError(f"パイプシャフト検出エラー: {str(e)}") from e
 
     def create_highlighted_image(
         self, original_image: Image.Image, detection_data: Dict[str, Any]
@@ -1170,34 +2304,33 @@ class GeminiImageAnalyzer:
         ・[x, y, width, height] 矩形として半透明塗り + 赤枠
         ・追加の形状推定は行わない（ズレの原因を排除）
         """
-        # 元画像をRGBAにして半透明オーバーレイを合成
+        # 元画像をRGBAにして、検出矩形の範囲だけ半透明オーバーレイを合成する
+        # （ページ全体サイズのオーバーレイ確保と全面合成を避ける）
         base = original_image.convert("RGBA")
         img_w, img_h = base.size
-        overlay = Image.new("RGBA", base.size, (0, 0, 0, 0))
-        draw = ImageDraw.Draw(overlay)
 
         outline_color = (255, 0, 0, 255)  # 赤
         fill_color = (255, 255, 0, 64)    # 薄い黄の半透明
-
-        def normalize_bbox(raw_bbox):
-            # delegate to shared helper
-            return self._to_pixel_bbox(raw_bbox, img_w, img_h)
+        # 線幅は画像サイズのみに依存するためループ外で一度だけ計算
+        line_w = max(2, int(min(img_w, img_h) * 0.003))
+        to_pixel_bbox = self._to_pixel_bbox
 
         skipped = 0
         drawn = 0
         for det in (detection_data.get("detections") or []):
-            bbox = normalize_bbox(
-                det.get("symbol_bbox")
-                or det.get("bbox")
-                or ( {"box_2d": det.get("box_2d")} if det.get("box_2d") is not None else None )
-                or det.get("box")
-            )
+            bbox = to_pixel_bbox(_detection_raw_bbox(det), img_w, img_h)
             if not bbox:
                 skipped += 1
                 continue
             x, y, w, h = bbox
-            line_w = max(2, int(min(img_w, img_h) * 0.003))
-            draw.rectangle([x, y, x + w, y + h], fill=fill_color, outline=outline_color, width=line_w)
+            # 矩形は終端座標を含むため+1（画像外は切り詰める）
+            region_w = min(w + 1, img_w - x)
+            region_h = min(h + 1, img_h - y)
+            overlay = Image.new("RGBA", (region_w, region_h), (0, 0, 0, 0))
+            ImageDraw.Draw(overlay).rectangle(
+                [0, 0, w, h], fill=fill_color, outline=outline_color, width=line_w
+            )
+            base.alpha_composite(overlay, dest=(x, y))
             drawn += 1
 
         try:
@@ -1207,7 +2340,7 @@ class GeminiImageAnalyzer:
         except Exception:
             pass
 
-        return Image.alpha_composite(base, overlay)
+        return base
 
     async def detect_target_image_in_pdf(
         self,
@@ -1227,134 +2360,105 @@ class GeminiImageAnalyzer:
         Returns:
             Dict[str, Any]: 構造化された検出結果
         """
-        import pathlib
-        from pdf2image import convert_from_bytes
-        
         # ターゲット画像の準備
         if custom_target_image:
             target_image = custom_target_image
         else:
-            # デフォルトのtarget.png画像を読み込む
-            target_image_path = (
-                pathlib.Path(__file__).parent.parent
-                / "assets"
-                / "images"
-                / "target.png"
+            # デフォルトのtarget.png画像（プロセス内で一度だけデコード）
+            target_image = _default_target_image()
+
+        # 同じPDF・ターゲット画像・モデルの検出結果は解析結果キャッシュ（メモリ/ディスク）から返す
+        # （ヒット時はPDFのラスタライズも行わない）
+        cache_key = None
+        if self._extraction_cache is not None:
+            cache_key = extraction_cache_key(
+                "detect_target_image_in_pdf",
+                self.model_name,
+                _TARGET_PROMPT_VERSION,
+                pdf_bytes,
+                await asyncio.to_thread(_image_fingerprint, target_image),
             )
-            if not target_image_path.exists():
-                raise FileNotFoundError(f"Target image not found: {target_image_path}")
-            target_image = Image.open(target_image_path)
-        
-        # PDFを画像に変換
-        images = convert_from_bytes(pdf_bytes, dpi=200)
-        
-        # 出力スキーマ
-        detection_schema: Dict[str, Any] = {
-            "type": "object",
-            "properties": {
-                "summary": {
-                    "type": "object",
-                    "properties": {
-                        "total_detections": {"type": "integer"},
-                        "notes": {"type": "string"},
-                    },
-                    "required": ["total_detections"],
-                },
-                "pages": {
-                    "type": "array",
-                    "items": {
-                        "type": "object",
-                        "properties": {
-                            "page": {"type": "integer"},
-                            "detections": {
-                                "type": "array",
-                                "items": {
-                                    "type": "object",
-                                    "properties": {
-                                        "position": {
-                                            "type": "object",
-                                            "properties": {
-                                                "x": {"type": "integer", "minimum": 0, "maximum": 1000},
-                                                "y": {"type": "integer", "minimum": 0, "maximum": 1000},
-                                            },
-                                            "required": ["x", "y"],
-                                        },
-                                        "confidence": {"type": "number"},
-                                        "description": {"type": "string"},
-                                    },
-                                    "required": ["position"],
-                                },
-                            },
-                        },
-                        "required": ["page", "detections"],
-                    },
-                },
-            },
-            "required": ["summary", "pages"],
-        }
+            cached = await self._extraction_cache.aget(cache_key)
+            if cached is not None:
+                if "summary" in cached and "pages" in cached:
+                    if debug:
+                        cached["_debug"] = {"cache": "hit", "model": self.model_name}
+                    return cached
+                await self._extraction_cache.adelete(cache_key)
+
+        # PDFは開くだけにして、各ページは送信直前に描画する（全ページを同時にメモリへ載せない）
+        # 送信時にmax_image_dimへ縮小されるため、最初からその解像度で描画する
+        renderer = await asyncio.to_thread(
+            PdfPageRenderer, pdf_bytes, dpi=200, max_dim=self.max_image_dim
+        )
 
         prompt = (
             "あなたは画像パターンマッチングの専門家です。\n"
-            "2枚目以降の画像から、1枚目の参照画像（ターゲット画像）と同じパターンを探してください。\n\n"
+            "1枚目の画像は参照画像（ターゲット画像）、2枚目の画像は検索対象の図面1ページです。\n"
+            "2枚目の画像から、参照画像と同じパターンを探してください。\n\n"
             "参照画像の特徴:\n"
             "- 円形の中に十字の線がある記号\n"
             "- 建築図面で使用される記号\n\n"
             "検出要件:\n"
-            "- 各ページで参照画像と同じ形状のパターンをすべて検出\n"
+            "- 2枚目の画像内で参照画像と同じ形状のパターンをすべて検出\n"
             "- 回転やサイズの違いがあっても検出すること\n"
-            "- 座標は[0,1000]の範囲に正規化して返すこと。ページの左上を(0,0)、右下を(1000,1000)とする\n"
+            "- 座標は2枚目の画像に対して[0,1000]の範囲に正規化して返すこと。左上を(0,0)、右下を(1000,1000)とする\n"
             "- position.x, position.y は検出対象の中心座標を[0,1000]の整数で記録\n"
-            "- 検出がなければ該当ページのdetectionsは空配列\n"
-            "- 1枚目は参照画像なので検出対象外（page 1から開始）\n"
+            "- pagesには2枚目の画像の結果を page: 1 として1件だけ返すこと\n"
+            "- 検出がなければdetectionsは空配列\n"
+            "- 1枚目の参照画像自体は検出対象外\n"
             "- スキーマに沿ったJSONのみを返すこと\n"
         )
 
         try:
-            # 画像パートを構築（ターゲット画像 + 各ページ）
-            all_images = [target_image] + images
-            
-            contents = self._build_contents(prompt, *all_images)
-
-            generation_config = types.GenerateContentConfig(
-                response_mime_type="application/json",
-                response_schema=detection_schema,
-            )
+            # ターゲット画像は一度だけエンコードし、全ページのリクエストで共有する
+            target_part = await asyncio.to_thread(self._target_part, target_image)
 
-            try:
-                response = self.client.models.generate_content(
-                    model=self.model_name,
-                    contents=contents,
-                    config=generation_config,
-                )
-            except Exception:
-                # 構造化出力未対応の場合のフォールバック
-                fallback_prompt = (
-                    prompt
-                    + "\n\n必ず次の形式のJSONのみを返してください: "
-                    + json.dumps(
-                        {
-                            "summary": {
-                                "total_detections": 0,
-                            },
-                            "pages": [],
-                        }
-                    )
-                )
-                response = self.client.models.generate_content(
-                    model=self.model_name,
-                    contents=self._build_contents(fallback_prompt, *all_images),
-                )
+            def _encode_page(index: int) -> types.Part:
+                # 描画した画像はエンコード後すぐに破棄し、送信用のPartだけを保持する
+                return self._pil_to_part(renderer.render(index))
 
-            data = self._extract_structured(response)
-            response_text = (getattr(response, "text", None) or "").strip()
+            # ページごとに「ターゲット画像 + 1ページ」のリクエストを並行して送る
+            # （所要時間は全ページの合計ではなく最も遅いページ程度になり、リトライも1ページ分で済む）
+            # 描画もセマフォ内で行うため、メモリ上のページはmax_concurrency枚までに抑えられる
+            sem = asyncio.Semaphore(self.max_concurrency)
 
-            if not isinstance(data, dict) or not data:
-                try:
-                    data = json.loads(response_text) if response_text else None
-                except Exception:
-                    data = None
+            async def _one(index: int):
+                async with sem:
+                    try:
+                        page_part = await asyncio.to_thread(_encode_page, index)
+                        return await self._detect_target_on_page(
+                            prompt, target_part, page_part
+                        )
+                    except Exception as e:
+                        # レート制限以外の失敗はそのページだけを失敗扱いにし、他のページは続行する
+                        if _is_rate_limited(e):
+                            raise
+                        logging.getLogger("pdf_highlight_api.gemini").warning(
+                            "Target detection failed on page %d: %s", index + 1, e
+                        )
+                        return None, ""
 
-            if not isinstance(data, dict) or "summary" not in data or "pages" not in data:
+            tasks = [asyncio.create_task(_one(i)) for i in range(len(renderer))]
+            try:
+                results = await asyncio.gather(*tasks)
+            finally:
+                # レート制限で1ページが失敗した場合は残りのページを止め、
+                # すべて終わってから描画器を閉じる
+                for task in tasks:
+                    task.cancel()
+                await asyncio.gather(*tasks, return_exceptions=True)
+
+            pages: List[Dict[str, Any]] = []
+            failed_pages: List[int] = []
+            for page_no, (detections, _) in enumerate(results, start=1):
+                if detections is None:
+                    failed_pages.append(page_no)
+                    detections = []
+                pages.append({"page": page_no, "detections": detections})
+            raw_text = "\n\n".join(text for _, text in results if text)
+
+            if not pages or len(failed_pages) == len(pages):
                 fb: Dict[str, Any] = {
                     "summary": {
                         "total_detections": 0,
@@ -1365,24 +2469,70 @@ class GeminiImageAnalyzer:
                 if debug:
                     fb["_debug"] = {
                         "prompt": prompt,
-                        "raw_response_text": response_text,
+                        "raw_response_text": raw_text,
                         "model": self.model_name,
                     }
                 return fb
 
+            summary: Dict[str, Any] = {
+                "total_detections": sum(len(p["detections"]) for p in pages)
+            }
+            if failed_pages:
+                summary["notes"] = (
+                    "fallback: failed to analyze pages "
+                    + ", ".join(map(str, failed_pages))
+                )
+            data: Dict[str, Any] = {"summary": summary, "pages": pages}
+
+            # 一部ページの解析に失敗した結果はキャッシュしない
+            if cache_key is not None and not failed_pages:
+                await self._extraction_cache.aput(
+                    cache_key,
+                    data,
+                    metadata={"method": "detect_target_image_in_pdf", "model": self.model_name},
+                )
+
             if debug:
-                data.setdefault("_debug", {})
-                try:
-                    data["_debug"].update(
-                        {
-                            "prompt": prompt,
-                            "raw_response_text": response_text or json.dumps(data),
-                            "model": self.model_name,
-                        }
-                    )
-                except Exception:
-                    pass
+                data["_debug"] = {
+                    "prompt": prompt,
+                    "raw_response_text": raw_text,
+                    "model": self.model_name,
+                }
 
             return data
         except Exception as e:
-            raise Exception(f"ターゲット画像検出エラー: {str(e)}")
+            if _is_rate_limited(e):
+                raise
+            raise RuntimeError(f"ターゲット画像検出エラー: {str(e)}") from e
+        finally:
+            renderer.close()
+
+    async def _detect_target_on_page(
+        self, prompt: str, target_part: types.Part, page_part: types.Part
+    ) -> Tuple[Optional[List[Dict[str, Any]]], str]:
+        """Run target detection on a single page.
+
+        Returns (detections, raw response text); detections is None when the
+        response could not be parsed.
+        """
+        # 構造化出力未対応の場合のフォールバック
+        fallback_prompt = (
+            f"{prompt}\n\n{_FALLBACK_JSON_INSTRUCTION}{_PAGES_FALLBACK_EXAMPLE}"
+        )
+        response = await self._generate_structured(
+            self._build_contents_with_parts(prompt, target_part, page_part),
+            _TARGET_GEN_CONFIG,
+            lambda: self._build_contents_with_parts(fallback_prompt, target_part, page_part),
+        )
+
+        response_text = (getattr(response, "text", None) or "").strip()
+        data = _validate_pages_result(self._extract_structured(response, response_text))
+        if data is None:
+            return None, response_text
+
+        # 1ページだけを送っているので、page 1（なければ先頭）の1件だけを採用する
+        # （番号の振り間違いや重複したページ項目の検出を二重に数えない）
+        if not data["pages"]:
+            return [], response_text
+        page = next((p for p in data["pages"] if p["page"] == 1), data["pages"][0])
+        return page["detections"], response_text
@@ -0,0 +1,147 @@
+"""
+PDFのラスタライズ（PyMuPDF）
+
+pdftoppm のサブプロセス起動や一時ファイルを伴わず、MuPDFでメモリ上に直接描画する。
+"""
+
+import os
+import math
+import functools
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Optional, Tuple
+
+import pymupdf
+from PIL import Image
+
+# PDF_RENDER_WORKERS を2以上にした場合のみ、複数ページのPDFをプロセスプールで並列に描画する（既定は逐次）
+# （PyMuPDFは描画中もGILを保持し、Documentもスレッド間で共有できないため、スレッドでは並列化できない）
+_RENDER_WORKERS = int(os.getenv("PDF_RENDER_WORKERS", "1"))
+
+# (width, height, RGBサンプル列)。ワーカーからはPILオブジェクトではなくこの形で受け取る
+_PageSamples = Tuple[int, int, bytes]
+
+
+def _page_samples(
+    page: pymupdf.Page, dpi: int, max_dim: Optional[int] = None
+) -> _PageSamples:
+    """Rasterise one page to raw RGB samples.
+
+    With max_dim the zoom is lowered so the long edge fits, which is far
+    cheaper than rendering at full dpi and resizing afterwards.
+    """
+    zoom = dpi / 72.0
+    if max_dim:
+        long_edge_pt = max(page.rect.width, page.rect.height)
+        if long_edge_pt > 0:
+            zoom = min(zoom, max_dim / long_edge_pt)
+    pix = page.get_pixmap(matrix=pymupdf.Matrix(zoom, zoom), alpha=False)
+    return pix.width, pix.height, pix.samples
+
+
+def _samples_to_image(samples: _PageSamples) -> Image.Image:
+    """Wrap raw RGB samples in a PIL image."""
+    width, height, data = samples
+    return Image.frombytes("RGB", (width, height), data)
+
+
+def _page_to_image(
+    page: pymupdf.Page, dpi: int, max_dim: Optional[int] = None
+) -> Image.Image:
+    """Render one page to an RGB PIL image."""
+    return _samples_to_image(_page_samples(page, dpi, max_dim))
+
+
+def render_pdf_pages(
+    pdf_bytes: bytes, dpi: int = 200, max_dim: Optional[int] = None
+) -> List[Image.Image]:
+    """
+    PDFの全ページをRGB画像に変換する
+
+    Args:
+        pdf_bytes: PDFファイルの生バイト列
+        dpi: 解像度
+        max_dim: 長辺の上限ピクセル数（超えるページはdpiを下げて描画、Noneで無効）
+
+    Returns:
+        List[Image.Image]: ページ順の画像リスト
+    """
+    with pymupdf.open(stream=pdf_bytes, filetype="pdf") as doc:
+        page_count = doc.page_count
+        if _RENDER_WORKERS < 2 or page_count < 2:
+            return [_page_to_image(page, dpi, max_dim) for page in doc]
+
+    # 連続したページ範囲に分けて各ワーカープロセスで描画し、ページ順に連結する
+    # （受け渡しは生のサンプル列のみで、PIL画像の組み立ては親プロセスで行う）
+    chunk = math.ceil(page_count / min(_RENDER_WORKERS, page_count))
+    pool = _render_pool()
+    futures = [
+        pool.submit(
+            _render_page_range, pdf_bytes, dpi, max_dim, start, min(start + chunk, page_count)
+        )
+        for start in range(0, page_count, chunk)
+    ]
+    return [
+        _samples_to_image(samples) for future in futures for samples in future.result()
+    ]
+
+
+@functools.lru_cache(maxsize=1)
+def _render_pool() -> ProcessPoolExecutor:
+    """Process pool shared by all renders.
+
+    forkserver forks workers from a small single-threaded server that has
+    preloaded only this module (PyMuPDF and PIL), so workers do not inherit
+    the server's threads. The pool lives for the whole process, so each
+    worker pays its start-up imports once. spawn is the fallback.
+    """
+    if "forkserver" in multiprocessing.get_all_start_methods():
+        ctx = multiprocessing.get_context("forkserver")
+        ctx.set_forkserver_preload([__name__])
+    else:  # pragma: no cover - platforms without fork (Windows)
+        ctx = multiprocessing.get_context("spawn")
+    return ProcessPoolExecutor(max_workers=_RENDER_WORKERS, mp_context=ctx)
+
+
+def _render_page_range(
+    pdf_bytes: bytes, dpi: int, max_dim: Optional[int], start: int, stop: int
+) -> List[_PageSamples]:
+    """Rasterise pages [start, stop) in a worker process."""
+    with pymupdf.open(stream=pdf_bytes, filetype="pdf") as doc:
+        return [_page_samples(doc[i], dpi, max_dim) for i in range(start, stop)]
+
+
+class PdfPageRenderer:
+    """
+    PDFを開いたまま、要求されたページだけを描画する
+
+    全ページを先にラスタライズしないため、同時にメモリへ載るのは処理中のページだけになる。
+    MuPDFのDocumentはスレッドセーフではないため、描画はロックで直列化する。
+    """
+
+    def __init__(self, pdf_bytes: bytes, dpi: int = 200, max_dim: Optional[int] = None):
+        self._doc = pymupdf.open(stream=pdf_bytes, filetype="pdf")
+        self._lock = threading.Lock()
+        self.dpi = dpi
+        self.max_dim = max_dim
+
+    def __len__(self) -> int:
+        return self._doc.page_count
+
+    def render(self, index: int) -> Image.Image:
+        """
+        0始まりのページ番号のページをRGB画像に変換する
+        """
+        with self._lock:
+            return _page_to_image(self._doc[index], self.dpi, self.max_dim)
+
+    def close(self) -> None:
+        with self._lock:
+            self._doc.close()
+
+    def __enter__(self) -> "PdfPageRenderer":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
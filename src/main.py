@@ -1,19 +1,43 @@
 from fastapi import FastAPI, File, UploadFile, HTTPException, Query
 from fastapi.middleware.cors import CORSMiddleware
-from pdf2image import convert_from_bytes
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import JSONResponse, ORJSONResponse, StreamingResponse
 from PIL import Image, ImageDraw
 import uvicorn
+import asyncio
 import io
+import json
 import base64
 import os
 import time
 import logging
-from src.infrastructure.gemini import GeminiImageAnalyzer
+import functools
+from typing import Literal, Optional
+from concurrent.futures import ThreadPoolExecutor
+from src.infrastructure.cache import get_extraction_cache
+from src.infrastructure.gemini import GeminiImageAnalyzer, load_api_keys
+from src.infrastructure.pdf import PdfPageRenderer, render_pdf_pages
+
+# orjsonが利用可能ならレスポンスのJSONシリアライズに使用（未導入時は標準JSON）
+try:
+    import orjson
+
+    default_response_class = ORJSONResponse
+
+    def _ndjson_line(obj) -> bytes:
+        return orjson.dumps(obj) + b"\n"
+
+except ImportError:
+    default_response_class = JSONResponse
+
+    def _ndjson_line(obj) -> bytes:
+        return json.dumps(obj, ensure_ascii=False).encode("utf-8") + b"\n"
 
 app = FastAPI(
     title="図面PDF解析API",
     version="0.2.0",
     description="図面PDFを分析し、PF100/PF150の文言とポイント数をカウントする特化型API",
+    default_response_class=default_response_class,
 )
 
 app.add_middleware(
@@ -23,6 +47,8 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+# Base64画像を含む大きなJSONレスポンスを圧縮
+app.add_middleware(GZipMiddleware, minimum_size=1024)
 
 # Logger setup (stdout)
 logger = logging.getLogger("pdf_highlight_api")
@@ -36,16 +62,16 @@ if not logger.handlers:
 logger.setLevel(logging.INFO)
 
 # Gemini API Key の状態を確認
-gemini_api_key = os.getenv("GEMINI_API_KEY")
+gemini_api_keys = load_api_keys()
 gemini_analyzer = None
 gemini_available = False
 
-if gemini_api_key:
+if gemini_api_keys:
     try:
         gemini_analyzer = GeminiImageAnalyzer()
         gemini_available = True
         print("✅ Gemini API Key found. Analysis features are available.")
-        logger.info("Gemini initialized and available")
+        logger.info("Gemini initialized and available: api_keys=%d", len(gemini_api_keys))
     except Exception as e:
         print(f"❌ Error initializing Gemini: {e}")
         print("🔧 Please check your GEMINI_API_KEY.")
@@ -56,6 +82,45 @@ else:
     print("📝 Get your API key from: https://makersuite.google.com/app/apikey")
     logger.warning("GEMINI_API_KEY not found; analysis endpoints unavailable")
 
+# アップロードサイズ上限（MB、環境変数 MAX_UPLOAD_MB で変更可能）
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_MB", "50")) * 1024 * 1024
+UPLOAD_CHUNK_BYTES = 1024 * 1024
+
+# プレビュー画像のJPEG品質
+PREVIEW_JPEG_QUALITY = 80
+
+# ページ画像のエンコード用スレッドプール（JPEG/zlibのエンコード中はGILが解放されるため並列に進む）
+_image_encode_executor = ThreadPoolExecutor(
+    max_workers=min(os.cpu_count() or 1, 8), thread_name_prefix="image-encode"
+)
+
+
+async def _read_upload(upload: UploadFile) -> bytes:
+    """
+    アップロードファイルをチャンク単位で読み込む
+    上限サイズを超えた時点で読み込みを打ち切り413を返す
+    """
+    chunks = []
+    total = 0
+    while chunk := await upload.read(UPLOAD_CHUNK_BYTES):
+        total += len(chunk)
+        if total > MAX_UPLOAD_BYTES:
+            raise HTTPException(
+                status_code=413,
+                detail=f"Uploaded file exceeds {MAX_UPLOAD_BYTES // (1024 * 1024)} MB limit",
+            )
+        chunks.append(chunk)
+    return b"".join(chunks)
+
+
+@functools.lru_cache(maxsize=8)
+def _get_analyzer(model_name: str) -> GeminiImageAnalyzer:
+    """
+    モデル名ごとにGeminiImageAnalyzerを1つだけ生成して使い回す
+    """
+    return GeminiImageAnalyzer(model_name=model_name)
+
+
 @app.get("/")
 async def hello_world():
     return {
@@ -78,6 +143,18 @@ async def hello_world():
     }
 
 
+@app.get("/cache/stats")
+async def cache_stats():
+    """
+    解析結果キャッシュ（メモリ層と、GEMINI_CACHE_DIR指定時のディスク層）の状態を返す
+    """
+    cache = get_extraction_cache()
+    if cache is None:
+        return {"enabled": False}
+    stats = await asyncio.to_thread(cache.stats)
+    return {"enabled": True, **stats}
+
+
 @app.post("/gemini/document-analyze")
 async def gemini_document_analyze(
     file: UploadFile = File(..., description="PDFファイルをアップロード"),
@@ -91,6 +168,9 @@ async def gemini_document_analyze(
     ),
     debug: bool = Query(False, description="デバッグ情報（プロンプト/生出力など）を含める"),
     dpi: int = Query(200, description="プレビュー画像のDPI（解像度）"),
+    preview_format: Literal["jpeg", "png"] = Query(
+        "jpeg", description="プレビュー/ハイライト画像の形式（jpeg または png）"
+    ),
 ):
     """
     PDFをGeminiに渡して解析結果を返す。
@@ -108,24 +188,32 @@ async def gemini_document_analyze(
         raise HTTPException(status_code=400, detail="Only PDF files are allowed")
 
     try:
-        pdf_bytes = await file.read()
+        pdf_bytes = await _read_upload(file)
         
         # PDFを画像に変換してプレビュー用のデータを作成
         print(f"🖼️  PDFを画像に変換中... (DPI: {dpi})")
-        images = convert_from_bytes(pdf_bytes, dpi=dpi)
+        images = await asyncio.to_thread(render_pdf_pages, pdf_bytes, dpi=dpi)
         print(f"✅ 変換完了: {len(images)}ページの画像を生成")
         
         # 画像プレビューデータを作成
-        preview_images = _create_image_previews(images)
+        preview_images = await asyncio.to_thread(_create_image_previews, images, preview_format)
         
         # Geminiで解析
-        analyzer = GeminiImageAnalyzer(model_name=model)
+        analyzer = _get_analyzer(model)
         result_json = await analyzer.analyze_pdf_document(pdf_bytes, prompt, debug=debug)
         
         # ハイライト付き画像を作成
         highlighted_images = []
         if isinstance(result_json, dict) and "pages" in result_json:
-            highlighted_images = _create_highlighted_images(images, result_json)
+            # 描画とエンコードはワーカースレッドで行い、イベントループを塞がない
+            highlighted_images = await asyncio.to_thread(
+                _create_highlighted_images,
+                images,
+                result_json,
+                inplace=True,
+                fmt=preview_format,
+                previews=preview_images,
+            )
 
         response_payload = {
             "filename": file.filename,
@@ -158,6 +246,17 @@ async def analyze_pdf(
         description="使用するGeminiモデル（gemini-2.5-pro または gemini-2.5-flash）",
     ),
     debug: bool = Query(False, description="デバッグ情報（検出根拠・プロンプト等）を付加する"),
+    batch: bool = Query(
+        False,
+        description="全ページの記号検出を1回のリクエストにまとめる（トークン節約。上限超過・失敗時はページごとに検出）",
+    ),
+    stream: bool = Query(
+        False,
+        description="結果をND-JSON（application/x-ndjson）で完了したページから順に返す",
+    ),
+    preview_format: Literal["jpeg", "png"] = Query(
+        "jpeg", description="プレビュー/ハイライト画像の形式（jpeg または png）"
+    ),
 ):
     """
     PDFファイル内の記号を検出してハイライト表示する
@@ -168,19 +267,23 @@ async def analyze_pdf(
     - highlight: ハイライト機能有効化フラグ（デフォルトTrue）
     - target_image: 検出対象の記号画像（オプション、指定しない場合はデフォルトのtarget.pngを使用）
     - model: 使用するGeminiモデル
+    - batch: 記号検出を1回のリクエストにまとめるかどうか（デフォルトFalse）
+    - stream: ND-JSONでページごとに逐次返すかどうか（デフォルトFalse）
 
     Returns:
     - 検出された記号の座標情報
     - ハイライト付き画像（highlight=Trueの場合）
+    - stream=Trueの場合は1行1イベントのND-JSON（meta → 完了順のpage → done）
     """
     print(f"📄 ハイライト処理開始: {file.filename}")
     logger.info(
-        "Analyze request: file=%s dpi=%s highlight=%s model=%s custom_target=%s",
+        "Analyze request: file=%s dpi=%s highlight=%s model=%s custom_target=%s batch=%s",
         file.filename,
         dpi,
         highlight,
         model,
         bool(target_image),
+        batch,
     )
 
     if not gemini_available:
@@ -194,26 +297,40 @@ async def analyze_pdf(
         print(f"❌ 無効なファイル形式: {file.filename}")
         raise HTTPException(status_code=400, detail="Only PDF files are allowed")
 
+    # ストリーミング時のページ描画器（応答に渡した後はストリーム側で閉じる）
+    renderer = None
+    renderer_handed_off = False
     try:
         print("📖 PDFファイルを読み込み中...")
-        pdf_bytes = await file.read()
-
-        print(f"🖼️  PDFを画像に変換中... (DPI: {dpi})")
-        t0 = time.perf_counter()
-        images = convert_from_bytes(pdf_bytes, dpi=dpi)
-        t1 = time.perf_counter()
-        print(f"✅ 変換完了: {len(images)}ページの画像を生成")
-        logger.info("PDF converted: pages=%d time_ms=%.1f", len(images), (t1 - t0) * 1000)
-
-        # 画像プレビューデータを作成
-        print("🎨 元画像プレビューデータを作成中...")
-        preview_images = _create_image_previews(images)
-        print("✅ 元画像プレビューデータ作成完了")
+        pdf_bytes = await _read_upload(file)
+
+        images = None
+        preview_images = []
+        if stream:
+            # 全ページを先に描画せず、各ページを処理する直前に描画・エンコードしてすぐ手放す
+            renderer = await asyncio.to_thread(PdfPageRenderer, pdf_bytes, dpi=dpi)
+            page_count = len(renderer)
+            print(f"✅ PDFを開きました: {page_count}ページ（ページごとに描画）")
+        else:
+            print(f"🖼️  PDFを画像に変換中... (DPI: {dpi})")
+            t0 = time.perf_counter()
+            images = await asyncio.to_thread(render_pdf_pages, pdf_bytes, dpi=dpi)
+            t1 = time.perf_counter()
+            page_count = len(images)
+            print(f"✅ 変換完了: {page_count}ページの画像を生成")
+            logger.info("PDF converted: pages=%d time_ms=%.1f", page_count, (t1 - t0) * 1000)
+
+            # 画像プレビューデータを作成
+            print("🎨 元画像プレビューデータを作成中...")
+            preview_images = await asyncio.to_thread(
+                _create_image_previews, images, preview_format
+            )
+            print("✅ 元画像プレビューデータ作成完了")
 
         # カスタムターゲット画像の処理
         custom_target_image = None
         if target_image:
-            target_bytes = await target_image.read()
+            target_bytes = await _read_upload(target_image)
             img_buffer = io.BytesIO(target_bytes)
             custom_target_image = Image.open(img_buffer)
             print(f"🎯 カスタムターゲット画像を使用: {target_image.filename}")
@@ -225,7 +342,7 @@ async def analyze_pdf(
 
         print(f"🤖 使用モデル: {model}")
         try:
-            model_analyzer = GeminiImageAnalyzer(model_name=model)
+            model_analyzer = _get_analyzer(model)
         except Exception as e:
             print(f"❌ モデル初期化エラー: {str(e)}")
             raise HTTPException(
@@ -246,82 +363,195 @@ async def analyze_pdf(
             }
 
         total_detections = 0
-        if highlight:
-            print("🎯 記号検出を開始")
+        target_description = (
+            target_overview.get("description") if isinstance(target_overview, dict) else None
+        )
+        # ページごとの検出を並行して実行（同時リクエスト数はアナライザーの上限に合わせる）
+        sem = asyncio.Semaphore(model_analyzer.max_concurrency)
+
+        # batch=Trueなら全ページを1回のリクエストで検出し、結果の無いページだけ個別に検出する
+        batch_results = [None] * page_count
+        batch_elapsed_ms = 0.0
+
+        async def _run_batch(batch_images):
+            nonlocal batch_results, batch_elapsed_ms
+            print(f"📦 {page_count}ページをまとめて記号検出中...")
+            batch_start = time.perf_counter()
+            batch_results = await model_analyzer.analyze_symbols_batch(
+                batch_images,
+                custom_target_image,
+                debug=debug,
+                target_description=target_description,
+            )
+            batch_elapsed_ms = (time.perf_counter() - batch_start) * 1000
 
-            for i, image in enumerate(images):
-                print(f"📍 ページ{i+1}: 記号検出中...")
-                if model_analyzer:
+        def _highlight_to_data_url(image, detection_data):
+            return _image_to_data_url(
+                model_analyzer.create_highlighted_image(image, detection_data),
+                preview_format,
+            )
+
+        async def _detect_page(i, image, preview=None):
+            detection_data = batch_results[i]
+            elapsed_ms = batch_elapsed_ms
+            if detection_data is None:
+                async with sem:
+                    print(f"📍 ページ{i+1}: 記号検出中...")
                     page_start = time.perf_counter()
-                    detection_data = (
-                        await model_analyzer.analyze_symbol_with_coordinates(
-                            image,
-                            custom_target_image,
-                            debug=debug,
-                            target_description=(
-                                target_overview.get("description") if isinstance(target_overview, dict) else None
-                            ),
-                        )
+                    detection_data = await model_analyzer.analyze_symbol_with_coordinates(
+                        image,
+                        custom_target_image,
+                        debug=debug,
+                        target_description=target_description,
+                    )
+                    elapsed_ms = (time.perf_counter() - page_start) * 1000
+            if "error" in detection_data:
+                return detection_data, None, elapsed_ms
+            # 検出が無ければ描画結果は元画像と同じなので、プレビューのデータをそのまま使う
+            if preview is not None and not detection_data.get("detections"):
+                return detection_data, preview, elapsed_ms
+            # 描画と画像エンコードはワーカースレッドで行い、他ページの検出待ちと重ねる
+            print(f"🎨 ページ{i+1}: ハイライト描画中...")
+            image_data = await asyncio.to_thread(_highlight_to_data_url, image, detection_data)
+            return detection_data, image_data, elapsed_ms
+
+        def _highlighted_entry(i, detection_data, image_data, elapsed_ms):
+            """Build the highlighted_images item for page i and return it with its detection count."""
+            if image_data is None:
+                print(
+                    f"⚠️ ページ{i+1}: 座標検出エラー - {detection_data.get('error', '不明なエラー')}"
+                )
+                logger.warning(
+                    "Page %d detection error: %s",
+                    i + 1,
+                    detection_data.get("error", "unknown"),
+                )
+                entry = {
+                    "page": i + 1,
+                    "error": detection_data.get("error", "座標検出に失敗しました"),
+                }
+                return entry, 0
+
+            print(f"✅ ページ{i+1}: ハイライト完了")
+            page_cnt = detection_data.get("summary", {}).get(
+                "total_detections", len(detection_data.get("detections", []))
+            )
+            logger.info(
+                "Page %d analyzed: detections=%s time_ms=%.1f",
+                i + 1,
+                page_cnt,
+                elapsed_ms,
+            )
+            entry = {
+                "page": i + 1,
+                "image_data": image_data,
+                "detections": detection_data.get("detections", []),
+                "summary": detection_data.get("summary", {}),
+            }
+            return entry, int(page_cnt or 0)
+
+        response_meta = {
+            "filename": file.filename,
+            "total_pages": page_count,
+            "dpi": dpi,
+            "highlight_enabled": highlight,
+            "analysis_type": "記号検出API",
+            "custom_target_used": target_image is not None,
+        }
+
+        if stream:
+            # 描画から行の受け渡しまでをセマフォ内で行い、同時にメモリへ載るページ数を抑える
+            page_sem = asyncio.Semaphore(model_analyzer.max_concurrency)
+            # 書き出し待ちのページ（満杯の間、ワーカーはページを保持したまま待つ）
+            done_pages = asyncio.Queue(maxsize=1)
+
+            async def _page_event(i):
+                image = await asyncio.to_thread(renderer.render, i)
+                # プレビューはハイライト描画より先に作る（描画は複製に対して行われる）
+                preview = await asyncio.to_thread(_image_to_data_url, image, preview_format)
+                event = {"type": "page", "page": i + 1, "image_data": preview}
+                page_cnt = 0
+                if highlight:
+                    detection_data, image_data, elapsed_ms = await _detect_page(
+                        i, image, preview
                     )
-                    page_end = time.perf_counter()
-                    all_detection_data.append(detection_data)
-
-                    if "error" not in detection_data:
-                        print(f"🎨 ページ{i+1}: ハイライト描画中...")
-                        highlighted_image = model_analyzer.create_highlighted_image(
-                            image, detection_data
-                        )
-
-                        # ハイライト済み画像をBase64エンコード
-                        img_buffer = io.BytesIO()
-                        highlighted_image.save(img_buffer, format="PNG")
-                        img_buffer.seek(0)
-                        img_base64 = base64.b64encode(img_buffer.getvalue()).decode(
-                            "utf-8"
-                        )
-
-                        highlighted_images.append(
-                            {
-                                "page": i + 1,
-                                "image_data": f"data:image/png;base64,{img_base64}",
-                                "detections": detection_data.get("detections", []),
-                                "summary": detection_data.get("summary", {}),
-                            }
-                        )
-                        print(f"✅ ページ{i+1}: ハイライト完了")
-                        page_cnt = detection_data.get("summary", {}).get(
-                            "total_detections", len(detection_data.get("detections", []))
-                        )
-                        total_detections += int(page_cnt or 0)
-                        logger.info(
-                            "Page %d analyzed: detections=%s time_ms=%.1f",
-                            i + 1,
-                            page_cnt,
-                            (page_end - page_start) * 1000,
-                        )
-                    else:
-                        print(
-                            f"⚠️ ページ{i+1}: 座標検出エラー - {detection_data.get('error', '不明なエラー')}"
-                        )
-                        logger.warning(
-                            "Page %d detection error: %s",
-                            i + 1,
-                            detection_data.get("error", "unknown"),
-                        )
-                        highlighted_images.append(
-                            {
-                                "page": i + 1,
-                                "error": detection_data.get(
-                                    "error", "座標検出に失敗しました"
-                                ),
-                            }
-                        )
-                else:
-                    print(f"⚠️ ページ{i+1}: Gemini分析機能を利用できません")
-                    logger.error("Page %d skipped: Gemini not available", i + 1)
-                    highlighted_images.append(
-                        {"page": i + 1, "error": "Gemini分析機能を利用できません"}
+                    event["highlighted_image"], page_cnt = _highlighted_entry(
+                        i, detection_data, image_data, elapsed_ms
                     )
+                    event["detection_data"] = detection_data
+                return event, page_cnt
+
+            async def _page_worker(i):
+                async with page_sem:
+                    try:
+                        item = await _page_event(i)
+                    except Exception as e:
+                        item = e
+                    await done_pages.put(item)
+
+            async def _events():
+                # 1行目にメタ情報、以降は完了したページから1行ずつ送り、最後に集計を送る
+                yield _ndjson_line(
+                    {"type": "meta", **response_meta, "target_image_overview": target_overview}
+                )
+                workers = []
+                try:
+                    if highlight and batch:
+                        # 一括検出には全ページが必要なため、この間だけ全ページを描画して保持する
+                        batch_images = [
+                            await asyncio.to_thread(renderer.render, i) for i in range(page_count)
+                        ]
+                        await _run_batch(batch_images)
+                        del batch_images
+                    workers = [asyncio.create_task(_page_worker(i)) for i in range(page_count)]
+                    stream_total = 0
+                    for _ in range(page_count):
+                        item = await done_pages.get()
+                        if isinstance(item, Exception):
+                            raise item
+                        event, page_cnt = item
+                        stream_total += page_cnt
+                        yield _ndjson_line(event)
+                    print(f"🎉 ハイライト処理完了: {file.filename}")
+                    logger.info(
+                        "Analyze stream completed: file=%s pages=%d detections=%d",
+                        file.filename,
+                        page_count,
+                        stream_total,
+                    )
+                    yield _ndjson_line({"type": "done", "total_detections": stream_total})
+                except Exception as e:
+                    # 送信開始後はステータスコードを変えられないため、エラーも1行として送る
+                    logger.exception("Unhandled error while streaming PDF analysis")
+                    yield _ndjson_line({"type": "error", "detail": f"Error processing PDF: {str(e)}"})
+                finally:
+                    # クライアント切断時などに残った検出を止め、終わってから描画器を閉じる
+                    for worker in workers:
+                        worker.cancel()
+                    await asyncio.gather(*workers, return_exceptions=True)
+                    await asyncio.to_thread(renderer.close)
+
+            renderer_handed_off = True
+            return StreamingResponse(_events(), media_type="application/x-ndjson")
+
+        if highlight:
+            print("🎯 記号検出を開始")
+            if batch:
+                await _run_batch(images)
+
+            results = await asyncio.gather(
+                *(
+                    _detect_page(i, image, preview_images[i]["image_data"])
+                    for i, image in enumerate(images)
+                )
+            )
+
+            # 結果はページ順に集計する
+            for i, (detection_data, image_data, elapsed_ms) in enumerate(results):
+                all_detection_data.append(detection_data)
+                entry, page_cnt = _highlighted_entry(i, detection_data, image_data, elapsed_ms)
+                highlighted_images.append(entry)
+                total_detections += page_cnt
             print("✅ 全ページのハイライト処理完了")
             logger.info(
                 "Highlighting finished: pages=%d total_detections=%d",
@@ -340,15 +570,7 @@ async def analyze_pdf(
             total_detections,
         )
 
-        response_data = {
-            "filename": file.filename,
-            "total_pages": len(images),
-            "images": preview_images,
-            "dpi": dpi,
-            "highlight_enabled": highlight,
-            "analysis_type": "記号検出API",
-            "custom_target_used": target_image is not None,
-        }
+        response_data = {**response_meta, "images": preview_images}
 
         # ハイライトデータの追加
         response_data["highlighted_images"] = highlighted_images
@@ -357,10 +579,15 @@ async def analyze_pdf(
 
         return response_data
 
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"❌ PDF処理エラー: {str(e)}")
         logger.exception("Unhandled error while processing PDF")
         raise HTTPException(status_code=500, detail=f"Error processing PDF: {str(e)}")
+    finally:
+        if renderer is not None and not renderer_handed_off:
+            renderer.close()
 
 
 @app.post("/gemini/pipe-shaft-detect")
@@ -372,6 +599,9 @@ async def gemini_pipe_shaft_detect(
     ),
     debug: bool = Query(False, description="デバッグ情報（プロンプト/生出力など）を含める"),
     dpi: int = Query(200, description="画像変換時のDPI（解像度）"),
+    preview_format: Literal["jpeg", "png"] = Query(
+        "jpeg", description="プレビュー/ハイライト画像の形式（jpeg または png）"
+    ),
 ):
     """
     PDFからパイプシャフトの座標を検出する。
@@ -390,24 +620,32 @@ async def gemini_pipe_shaft_detect(
         raise HTTPException(status_code=400, detail="Only PDF files are allowed")
 
     try:
-        pdf_bytes = await file.read()
+        pdf_bytes = await _read_upload(file)
         
         # PDFを画像に変換
         print(f"🖼️  PDFを画像に変換中... (DPI: {dpi})")
-        images = convert_from_bytes(pdf_bytes, dpi=dpi)
+        images = await asyncio.to_thread(render_pdf_pages, pdf_bytes, dpi=dpi)
         print(f"✅ 変換完了: {len(images)}ページの画像を生成")
         
         # 画像プレビューデータを作成
-        preview_images = _create_image_previews(images)
+        preview_images = await asyncio.to_thread(_create_image_previews, images, preview_format)
         
         # Geminiで解析（パイプシャフト検出用のプロンプトを使用）
-        analyzer = GeminiImageAnalyzer(model_name=model)
+        analyzer = _get_analyzer(model)
         result_json = await analyzer.analyze_pipe_shafts(pdf_bytes, debug=debug)
         
         # ハイライト付き画像を作成
         highlighted_images = []
         if isinstance(result_json, dict) and "pages" in result_json:
-            highlighted_images = _create_highlighted_images(images, result_json)
+            # 描画とエンコードはワーカースレッドで行い、イベントループを塞がない
+            highlighted_images = await asyncio.to_thread(
+                _create_highlighted_images,
+                images,
+                result_json,
+                inplace=True,
+                fmt=preview_format,
+                previews=preview_images,
+            )
 
         response_payload = {
             "filename": file.filename,
@@ -425,29 +663,107 @@ async def gemini_pipe_shaft_detect(
         logger.exception("Gemini pipe shaft detection error")
         raise HTTPException(status_code=500, detail=f"Error analyzing PDF with Gemini: {str(e)}")
 
-def _create_image_previews(images: list) -> list:
+def _image_to_data_url(image: Image.Image, fmt: str = "jpeg") -> str:
     """
-    画像のBase64エンコードプレビューを作成
+    画像をJPEG（fmt="png"ならPNG）でエンコードしてdata URLを返す
+    エンコード済みバッファはgetbuffer()で参照し、getvalue()によるコピーを作らない
+    図面のPNGはページあたり数MBになるため、表示専用のプレビューは既定でJPEGにする
+    PNGはzlibレベル1（デフォルト6より数倍速い）で、サイズ増より応答時間を優先する
     """
-    preview_images = []
-    for i, image in enumerate(images):
-        img_buffer = io.BytesIO()
-        image.save(img_buffer, format="PNG")
-        img_buffer.seek(0)
+    img_buffer = io.BytesIO()
+    if fmt == "png":
+        image.save(img_buffer, format="PNG", compress_level=1, optimize=False)
+        mime = "image/png"
+    else:
+        if image.mode != "RGB":
+            image = image.convert("RGB")
+        # progressiveは複数パス走査でエンコードが遅くなるため使わない
+        image.save(img_buffer, format="JPEG", quality=PREVIEW_JPEG_QUALITY, optimize=False)
+        mime = "image/jpeg"
+    with img_buffer.getbuffer() as view:
+        img_base64 = base64.b64encode(view).decode("ascii")
+    return f"data:{mime};base64,{img_base64}"
 
-        img_base64 = base64.b64encode(img_buffer.getvalue()).decode("utf-8")
-        preview_images.append(
-            {"page": i + 1, "image_data": f"data:image/png;base64,{img_base64}"}
-        )
 
-    return preview_images
+def _create_image_previews(images: list, fmt: str = "jpeg") -> list:
+    """
+    画像のBase64エンコードプレビューを作成（ページごとのエンコードは並列に行う）
+    """
+    encode = functools.partial(_image_to_data_url, fmt=fmt)
+    data_urls = _image_encode_executor.map(encode, images)
+    return [
+        {"page": i + 1, "image_data": image_data}
+        for i, image_data in enumerate(data_urls)
+    ]
+
+
+def _highlighted_data_url(
+    image: Image.Image, index: int, drawn: int, fmt: str, previews: Optional[list]
+) -> str:
+    """Encode a highlighted page, reusing its preview data URL when nothing was drawn."""
+    if not drawn and previews is not None and index < len(previews):
+        return previews[index]["image_data"]
+    return _image_to_data_url(image, fmt)
+
+
+# パイプシャフト種別ごとのハイライト色（塗り, 枠）。先に一致したものを採用する
+_PIPE_SHAFT_HIGHLIGHT_COLORS = (
+    ("PF100", ("red", "darkred")),
+    ("PF150", ("blue", "darkblue")),
+)
 
 
-def _create_highlighted_images(images: list, detection_data: dict) -> list:
+def _pipe_shaft_highlight_colors(target_type: str):
+    """Return (fill, outline) for a PF100/PF150 label, or None to skip it."""
+    for label, colors in _PIPE_SHAFT_HIGHLIGHT_COLORS:
+        if label in target_type:
+            return colors
+    return None
+
+
+# ハイライトのマーカーは種類・サイズごとに一度だけ描画し、各検出位置へ貼り付ける
+# （検出ごとに図形をラスタライズし直さない。マスクで描画部分だけを上書きするため結果は直接描画と同じ）
+@functools.lru_cache(maxsize=32)
+def _circle_marker(mode: str, radius: int, color: str, outline_color: str):
+    """Return (stamp, mask) of a pipe-shaft circle with its centre at (radius, radius)."""
+    size = 2 * radius + 1
+    stamp = Image.new(mode, (size, size))
+    mask = Image.new("L", (size, size), 0)
+    for canvas, outline, fill in ((stamp, outline_color, color), (mask, 255, 255)):
+        draw = ImageDraw.Draw(canvas)
+        draw.ellipse([(0, 0), (size - 1, size - 1)], outline=outline, width=4)
+        draw.ellipse([(radius - 6, radius - 6), (radius + 6, radius + 6)], fill=fill)
+    return stamp, mask
+
+
+@functools.lru_cache(maxsize=32)
+def _target_marker(mode: str, half_size: int):
+    """Return (stamp, mask) of a target box with a centre cross at (half_size, half_size)."""
+    size = 2 * half_size + 1
+    cross_size = 10
+    c = half_size
+    stamp = Image.new(mode, (size, size))
+    mask = Image.new("L", (size, size), 0)
+    for canvas, color in ((stamp, "red"), (mask, 255)):
+        draw = ImageDraw.Draw(canvas)
+        draw.rectangle([(0, 0), (size - 1, size - 1)], outline=color, width=3)
+        draw.line([(c - cross_size, c), (c + cross_size, c)], fill=color, width=2)
+        draw.line([(c, c - cross_size), (c, c + cross_size)], fill=color, width=2)
+    return stamp, mask
+
+
+def _create_highlighted_images(
+    images: list,
+    detection_data: dict,
+    inplace: bool = False,
+    fmt: str = "jpeg",
+    previews: Optional[list] = None,
+) -> list:
     """
     検出結果に基づいてハイライト付き画像を作成
     座標は1-1000の範囲でスケーリングされているため、実際の画像サイズに変換
     PF100とPF150のみをハイライト表示
+    previews（同じ形式の _create_image_previews の結果）を渡すと、何も描画しなかったページはそのデータを再利用する
     """
     highlighted_images = []
     
@@ -460,60 +776,46 @@ def _create_highlighted_images(images: list, detection_data: dict) -> list:
     
     for i, image in enumerate(images):
         page_num = i + 1
-        # 画像をコピーして描画用に準備
-        img_copy = image.copy()
-        draw = ImageDraw.Draw(img_copy)
+        # 描画用の画像を準備（inplace=Trueなら元画像へ直接描画し、ページ全体の複製を避ける）
+        img_copy = image if inplace else image.copy()
         
         # 画像の実際のサイズを取得
         img_width, img_height = img_copy.size
         
         # この ページの検出データを取得
         page_detections = pages_data.get(page_num, [])
+
+        # 座標変換の倍率と円の半径はページ内で共通のためループ外で一度だけ計算
+        scale_x = img_width / 1000
+        scale_y = img_height / 1000
+        radius = max(30, min(img_width, img_height) // 35)
+        drawn = 0
         
         # 各検出位置にハイライトを描画（PF100とPF150のみ）
         for detection in page_detections:
-            # targetまたはtypeフィールドをチェック
+            # targetまたはtypeフィールドをチェックし、種別と色を一度の走査で決める
             target_type = detection.get("target", "") or detection.get("type", "")
+            colors = _pipe_shaft_highlight_colors(target_type)
             
             # PF100またはPF150のみハイライト
-            if "PF100" not in target_type and "PF150" not in target_type:
+            if colors is None:
                 continue
+            color, outline_color = colors
                 
-            if "position" in detection and "x" in detection["position"] and "y" in detection["position"]:
+            position = detection.get("position")
+            if isinstance(position, dict) and "x" in position and "y" in position:
                 # 1-1000の座標を実際の画像座標に変換（中心座標）
-                x = int(detection["position"]["x"] * img_width / 1000)
-                y = int(detection["position"]["y"] * img_height / 1000)
+                x = int(position["x"] * scale_x)
+                y = int(position["y"] * scale_y)
                 
-                # ターゲットタイプによって色を変える
-                if "PF100" in target_type:
-                    color = "red"
-                    outline_color = "darkred"
-                elif "PF150" in target_type:
-                    color = "blue"
-                    outline_color = "darkblue"
-                
-                # ハイライト円を描画（半径は画像サイズに応じて調整）
-                radius = max(30, min(img_width, img_height) // 35)
-                draw.ellipse(
-                    [(x - radius, y - radius), (x + radius, y + radius)],
-                    outline=outline_color,
-                    width=4
-                )
-                # 中心点を描画
-                draw.ellipse(
-                    [(x - 6, y - 6), (x + 6, y + 6)],
-                    fill=color
-                )
-        
-        # Base64エンコード
-        img_buffer = io.BytesIO()
-        img_copy.save(img_buffer, format="PNG")
-        img_buffer.seek(0)
-        img_base64 = base64.b64encode(img_buffer.getvalue()).decode("utf-8")
+                # ハイライト円と中心点を貼り付け（半径は画像サイズに応じて調整）
+                stamp, mask = _circle_marker(img_copy.mode, radius, color, outline_color)
+                img_copy.paste(stamp, (x - radius, y - radius), mask)
+                drawn += 1
         
         highlighted_images.append({
             "page": page_num,
-            "image_data": f"data:image/png;base64,{img_base64}",
+            "image_data": _highlighted_data_url(img_copy, i, drawn, fmt, previews),
             "detections": page_detections
         })
     
@@ -530,6 +832,9 @@ async def detect_target_image(
     ),
     debug: bool = Query(False, description="デバッグ情報（プロンプト/生出力など）を含める"),
     dpi: int = Query(200, description="画像変換時のDPI（解像度）"),
+    preview_format: Literal["jpeg", "png"] = Query(
+        "jpeg", description="プレビュー/ハイライト画像の形式（jpeg または png）"
+    ),
 ):
     """
     PDFから指定画像（デフォルト: target.png）と同じパターンを検出する。
@@ -548,26 +853,26 @@ async def detect_target_image(
         raise HTTPException(status_code=400, detail="Only PDF files are allowed")
 
     try:
-        pdf_bytes = await file.read()
+        pdf_bytes = await _read_upload(file)
         
         # PDFを画像に変換
         print(f"🖼️  PDFを画像に変換中... (DPI: {dpi})")
-        images = convert_from_bytes(pdf_bytes, dpi=dpi)
+        images = await asyncio.to_thread(render_pdf_pages, pdf_bytes, dpi=dpi)
         print(f"✅ 変換完了: {len(images)}ページの画像を生成")
         
         # 画像プレビューデータを作成
-        preview_images = _create_image_previews(images)
+        preview_images = await asyncio.to_thread(_create_image_previews, images, preview_format)
         
         # カスタムターゲット画像の処理
         custom_target_image = None
         if target_image:
-            target_bytes = await target_image.read()
+            target_bytes = await _read_upload(target_image)
             img_buffer = io.BytesIO(target_bytes)
             custom_target_image = Image.open(img_buffer)
             print(f"🎯 カスタムターゲット画像を使用: {target_image.filename}")
         
         # Geminiで解析（画像マッチング）
-        analyzer = GeminiImageAnalyzer(model_name=model)
+        analyzer = _get_analyzer(model)
         result_json = await analyzer.detect_target_image_in_pdf(
             pdf_bytes, 
             custom_target_image=custom_target_image,
@@ -577,7 +882,15 @@ async def detect_target_image(
         # ハイライト付き画像を作成
         highlighted_images = []
         if isinstance(result_json, dict) and "pages" in result_json:
-            highlighted_images = _create_target_highlighted_images(images, result_json)
+            # 描画とエンコードはワーカースレッドで行い、イベントループを塞がない
+            highlighted_images = await asyncio.to_thread(
+                _create_target_highlighted_images,
+                images,
+                result_json,
+                inplace=True,
+                fmt=preview_format,
+                previews=preview_images,
+            )
 
         response_payload = {
             "filename": file.filename,
@@ -597,10 +910,17 @@ async def detect_target_image(
         raise HTTPException(status_code=500, detail=f"Error analyzing PDF with Gemini: {str(e)}")
 
 
-def _create_target_highlighted_images(images: list, detection_data: dict) -> list:
+def _create_target_highlighted_images(
+    images: list,
+    detection_data: dict,
+    inplace: bool = False,
+    fmt: str = "jpeg",
+    previews: Optional[list] = None,
+) -> list:
     """
     ターゲット画像検出結果に基づいてハイライト付き画像を作成
     position.x,y座標を中心に矩形を描画
+    previews（同じ形式の _create_image_previews の結果）を渡すと、何も描画しなかったページはそのデータを再利用する
     """
     highlighted_images = []
     
@@ -612,48 +932,38 @@ def _create_target_highlighted_images(images: list, detection_data: dict) -> lis
     
     for i, image in enumerate(images):
         page_num = i + 1
-        # 画像をコピーして描画用に準備
-        img_copy = image.copy()
-        draw = ImageDraw.Draw(img_copy)
+        # 描画用の画像を準備（inplace=Trueなら元画像へ直接描画し、ページ全体の複製を避ける）
+        img_copy = image if inplace else image.copy()
         
         # 画像の実際のサイズを取得
         img_width, img_height = img_copy.size
         
         # このページの検出データを取得
         page_detections = pages_data.get(page_num, [])
+
+        # 座標変換の倍率と矩形サイズはページ内で共通のためループ外で一度だけ計算
+        scale_x = img_width / 1000
+        scale_y = img_height / 1000
+        # 赤い矩形でハイライト（target.pngのサイズに基づいて調整）
+        half_size = max(20, min(img_width, img_height) // 50)
+        stamp, mask = _target_marker(img_copy.mode, half_size)
+        drawn = 0
         
         # 各検出位置にハイライトを描画
         for detection in page_detections:
-            if "position" in detection and "x" in detection["position"] and "y" in detection["position"]:
+            position = detection.get("position")
+            if isinstance(position, dict) and "x" in position and "y" in position:
                 # 1-1000の座標を実際の画像座標に変換（中心座標）
-                x = int(detection["position"]["x"] * img_width / 1000)
-                y = int(detection["position"]["y"] * img_height / 1000)
-                
-                # 赤い矩形でハイライト（target.pngのサイズに基づいて調整）
-                half_width = max(20, min(img_width, img_height) // 50)
-                half_height = max(20, min(img_width, img_height) // 50)
+                x = int(position["x"] * scale_x)
+                y = int(position["y"] * scale_y)
                 
-                # 矩形を描画
-                draw.rectangle(
-                    [(x - half_width, y - half_height), (x + half_width, y + half_height)],
-                    outline="red",
-                    width=3
-                )
-                
-                # 中心に十字マークを描画
-                cross_size = 10
-                draw.line([(x - cross_size, y), (x + cross_size, y)], fill="red", width=2)
-                draw.line([(x, y - cross_size), (x, y + cross_size)], fill="red", width=2)
-        
-        # Base64エンコード
-        img_buffer = io.BytesIO()
-        img_copy.save(img_buffer, format="PNG")
-        img_buffer.seek(0)
-        img_base64 = base64.b64encode(img_buffer.getvalue()).decode("utf-8")
+                # 矩形と中心の十字マークを貼り付け
+                img_copy.paste(stamp, (x - half_size, y - half_size), mask)
+                drawn += 1
         
         highlighted_images.append({
             "page": page_num,
-            "image_data": f"data:image/png;base64,{img_base64}",
+            "image_data": _highlighted_data_url(img_copy, i, drawn, fmt, previews),
             "detections": page_detections
         })
     